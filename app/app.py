@@ -1,8 +1,14 @@
 import streamlit as st
-import sqlite3
-import pandas as pd
-from datetime import datetime
-from model_utils import CarPriceModel
+from datetime import datetime, timedelta
+from database import (
+    HISTORY_PAGE_SIZE,
+    init_database,
+    load_prediction_page,
+    load_prediction_stats,
+    save_prediction_async,
+)
+from model_utils import MODEL_PATH, REFERENCE_YEARS
+from server import load_serving_model
 import os
 
 # Configuração da página
@@ -11,66 +17,6 @@ st.set_page_config(
 )
 
 
-# Função para inicializar o banco de dados
-def init_database():
-    """Inicializa o banco de dados SQLite"""
-    conn = sqlite3.connect("car_predictions.db")
-    cursor = conn.cursor()
-
-    cursor.execute(
-        """
-        CREATE TABLE IF NOT EXISTS predictions (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            timestamp TEXT,
-            year_of_reference INTEGER,
-            brand TEXT,
-            model TEXT,
-            fuel TEXT,
-            gear TEXT,
-            engine_size REAL,
-            year_model INTEGER,
-            predicted_price REAL,
-            is_good_prediction BOOLEAN,
-            user_corrected_price REAL,
-            user_comments TEXT
-        )
-    """
-    )
-
-    conn.commit()
-    conn.close()
-
-
-# Função para salvar predição no banco
-def save_prediction(prediction_data):
-    """Salva a predição no banco de dados"""
-    conn = sqlite3.connect("car_predictions.db")
-    cursor = conn.cursor()
-
-    cursor.execute(
-        """
-        INSERT INTO predictions (
-            timestamp, year_of_reference, brand, model, fuel, gear, 
-            engine_size, year_model, predicted_price, is_good_prediction, 
-            user_corrected_price, user_comments
-        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-    """,
-        prediction_data,
-    )
-
-    conn.commit()
-    conn.close()
-
-
-# Função para carregar histórico de predições
-def load_prediction_history():
-    """Carrega o histórico de predições"""
-    conn = sqlite3.connect("car_predictions.db")
-    df = pd.read_sql_query("SELECT * FROM predictions ORDER BY timestamp DESC", conn)
-    conn.close()
-    return df
-
-
 # Função para exibir a tela de entrada de dados
 def show_input_screen(car_model):
     """Tela principal para entrada de dados do veículo"""
@@ -89,7 +35,7 @@ def show_input_screen(car_model):
         # Campos de entrada
         year_of_reference = st.selectbox(
             "🗓️ Ano de Referência da Tabela FIPE",
-            options=[2020, 2021, 2022, 2023, 2024],
+            options=REFERENCE_YEARS,
             index=2,
         )
 
@@ -173,18 +119,13 @@ def show_input_screen(car_model):
     with col2:
         st.header("📊 Estatísticas Rápidas")
 
-        # Carregar histórico para estatísticas
-        history_df = load_prediction_history()
-
-        if len(history_df) > 0:
-            st.metric("📈 Total de Predições Avaliadas", len(history_df))
-
-            good_predictions = history_df["is_good_prediction"].sum()
-            accuracy_pct = (good_predictions / len(history_df)) * 100
-            st.metric("✅ Taxa de Acerto", f"{accuracy_pct:.1f}%")
+        # Estatísticas agregadas (uma linha, sem ler o histórico)
+        stats = load_prediction_stats()
 
-            avg_predicted = history_df["predicted_price"].mean()
-            st.metric("💰 Preço Médio", f"R$ {avg_predicted:,.0f}")
+        if stats["total"] > 0:
+            st.metric("📈 Total de Predições Avaliadas", stats["total"])
+            st.metric("✅ Taxa de Acerto", f"{stats['accuracy_pct']:.1f}%")
+            st.metric("💰 Preço Médio", f"R$ {stats['avg_predicted_price']:,.0f}")
 
             if st.button("📋 Ver Histórico Completo"):
                 st.session_state.current_screen = "history"
@@ -302,9 +243,15 @@ def show_result_screen():
                 user_comments if user_comments.strip() else None,
             )
 
-            save_prediction(prediction_data_tuple)
-            st.success("✅ Avaliação salva com sucesso!")
-            st.balloons()
+            # Gravação em lote em segundo plano: o clique não espera o disco e
+            # o resultado é confirmado quando o lote for gravado
+            try:
+                st.session_state.pending_save = save_prediction_async(
+                    prediction_data_tuple
+                )
+            except ValueError as e:
+                st.error(f"❌ Avaliação inválida: {e}")
+            show_save_status()
 
     with col2:
         if st.button("🔄 Nova Consulta", type="secondary", use_container_width=True):
@@ -320,8 +267,25 @@ def show_result_screen():
             st.rerun()
 
 
+# Função para exibir o resultado da última gravação
+def show_save_status():
+    """Mostra se a última avaliação enviada já foi gravada ou falhou"""
+    saving = st.session_state.get("pending_save")
+    if saving is None:
+        return
+    if not saving.done():
+        st.info("⏳ Avaliação enviada, aguardando gravação...")
+        return
+    del st.session_state.pending_save
+    if saving.exception() is not None:
+        st.error(f"❌ Erro ao salvar a avaliação: {saving.exception()}")
+        return
+    st.success("✅ Avaliação salva com sucesso!")
+    st.balloons()
+
+
 # Função para exibir o histórico
-def show_history_screen():
+def show_history_screen(car_model):
     """Tela de histórico de predições"""
     st.title("📈 Histórico de Predições")
     st.markdown("---")
@@ -339,34 +303,74 @@ def show_history_screen():
             st.rerun()
 
     # Carregar e exibir histórico
-    history_df = load_prediction_history()
+    stats = load_prediction_stats()
 
-    if len(history_df) > 0:
+    if stats["total"] > 0:
         # Estatísticas detalhadas
         st.header("📊 Estatísticas Gerais")
 
         col1, col2, col3, col4 = st.columns(4)
 
         with col1:
-            st.metric("📈 Total de Predições Avaliadas", len(history_df))
+            st.metric("📈 Total de Predições Avaliadas", stats["total"])
 
         with col2:
-            good_predictions = history_df["is_good_prediction"].sum()
-            accuracy_pct = (good_predictions / len(history_df)) * 100
-            st.metric("✅ Taxa de Acerto", f"{accuracy_pct:.1f}%")
+            st.metric("✅ Taxa de Acerto", f"{stats['accuracy_pct']:.1f}%")
 
         with col3:
-            avg_predicted = history_df["predicted_price"].mean()
-            st.metric("💰 Preço Médio Previsto", f"R$ {avg_predicted:,.0f}")
+            st.metric(
+                "💰 Preço Médio Previsto", f"R$ {stats['avg_predicted_price']:,.0f}"
+            )
 
         with col4:
-            corrected_count = history_df["user_corrected_price"].notna().sum()
-            st.metric("💡 Correções de Usuário", corrected_count)
+            st.metric("💡 Correções de Usuário", stats["corrected_count"])
 
         st.markdown("---")
         st.header("📋 Histórico Detalhado")
 
-        # Tabela de histórico
+        # Filtros aplicados no SQL
+        unique_values = car_model.get_unique_values()
+        filter_col1, filter_col2, filter_col3, filter_col4 = st.columns(4)
+
+        with filter_col1:
+            brand = st.selectbox("🏭 Marca", ["Todas"] + list(unique_values["brands"]))
+
+        with filter_col2:
+            models = car_model.get_models_by_brand(brand) if brand != "Todas" else ()
+            model = st.selectbox(
+                "🚙 Modelo", ["Todos"] + list(models), disabled=brand == "Todas"
+            )
+
+        with filter_col3:
+            date_range = st.date_input("📅 Período", value=(), format="DD/MM/YYYY")
+
+        with filter_col4:
+            rating = st.selectbox("✅ Avaliação", ["Todas", "Boas", "Ruins"])
+
+        filters = {
+            "brand": None if brand == "Todas" else brand,
+            "model": None if model == "Todos" else model,
+            "start_date": date_range[0].isoformat() if len(date_range) > 0 else None,
+            # O fim do período é inclusivo na tela e exclusivo na consulta
+            "end_date": (
+                (date_range[1] + timedelta(days=1)).isoformat()
+                if len(date_range) > 1
+                else None
+            ),
+            "is_good": {"Todas": None, "Boas": True, "Ruins": False}[rating],
+        }
+
+        # Pilha de cursores: o último é o início da página atual
+        if st.session_state.get("history_filters") != filters:
+            st.session_state.history_filters = filters
+            st.session_state.history_cursors = [None]
+        cursors = st.session_state.history_cursors
+
+        history_df, next_cursor = load_prediction_page(
+            after=cursors[-1], page_size=HISTORY_PAGE_SIZE, **filters
+        )
+
+        # Tabela de histórico (apenas a página visível)
         st.dataframe(
             history_df[
                 [
@@ -400,6 +404,21 @@ def show_history_screen():
                 "user_comments": "💬 Comentários",
             },
         )
+
+        page_col1, page_col2, page_col3 = st.columns([1, 1, 2])
+
+        with page_col1:
+            if st.button("⬅️ Anterior", disabled=len(cursors) == 1):
+                cursors.pop()
+                st.rerun()
+
+        with page_col2:
+            if st.button("Próxima ➡️", disabled=next_cursor is None):
+                cursors.append(next_cursor)
+                st.rerun()
+
+        with page_col3:
+            st.caption(f"Página {len(cursors)}")
     else:
         st.info("📭 Nenhuma predição foi feita ainda.")
 
@@ -418,7 +437,7 @@ def main():
         st.session_state.current_screen = "input"
 
     # Verificar se o modelo existe, se não, treinar
-    model_path = "car_price_model.pkl"
+    model_path = MODEL_PATH
     if not os.path.exists(model_path):
         with st.spinner("🤖 Treinando modelo... Isso pode demorar alguns minutos."):
             from model_utils import ensure_model_trained
@@ -427,14 +446,10 @@ def main():
                 st.error("❌ Erro ao treinar o modelo. Verifique se o dataset existe.")
                 return
 
-    # Carregar modelo
+    # Carregar modelo (o catálogo de entradas vem do próprio artefato)
     @st.cache_resource
     def load_model():
-        car_model = CarPriceModel()
-        if car_model.load_and_preprocess_data():
-            car_model.load_model(model_path)
-            return car_model
-        return None
+        return load_serving_model(model_path)
 
     car_model = load_model()
 
@@ -442,13 +457,16 @@ def main():
         st.error("❌ Erro ao carregar o modelo ou dataset.")
         return
 
+    # Confirmação pendente de uma avaliação salva em rerun anterior
+    show_save_status()
+
     # Roteamento de telas
     if st.session_state.current_screen == "input":
         show_input_screen(car_model)
     elif st.session_state.current_screen == "result":
         show_result_screen()
     elif st.session_state.current_screen == "history":
-        show_history_screen()
+        show_history_screen(car_model)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,110 @@
+import os
+import queue
+import threading
+import time
+
+
+class BatchWorker:
+    """Thread em segundo plano que consome uma fila em lotes
+
+    Base de PredictionWriter e PredictionBatcher. A thread é criada na
+    primeira chamada de `_ensure_started` e recriada depois de um fork. Cada
+    lote junta até `max_batch_size` itens, esperando no máximo até o prazo
+    devolvido por `_batch_deadline` para o primeiro item. As subclasses
+    implementam `_process_batch` e `_batch_futures`: se `_process_batch`
+    levantar uma exceção, todo Future do lote que ainda não foi resolvido a
+    recebe, para que nenhum chamador fique esperando para sempre.
+    """
+
+    _STOP = object()
+    thread_name = "batch-worker"
+
+    def __init__(self, max_batch_size):
+        self.max_batch_size = max_batch_size
+        self._lock = threading.Lock()
+        self._pid = None
+        self._thread = None
+        self._queue = None
+
+    def _ensure_started(self):
+        with self._lock:
+            # Depois de um fork a thread do processo pai não existe no filho
+            if (
+                self._thread is not None
+                and self._pid == os.getpid()
+                and self._thread.is_alive()
+            ):
+                return
+            self._pid = os.getpid()
+            self._queue = queue.Queue()
+            self._reset_stats()
+            self._thread = threading.Thread(
+                target=self._run, name=self.thread_name, daemon=True
+            )
+            self._thread.start()
+
+    def _reset_stats(self):
+        """Zera os contadores ao (re)iniciar a thread"""
+
+    def _batch_deadline(self, first_item):
+        """Instante (time.perf_counter) em que o lote é fechado"""
+        raise NotImplementedError
+
+    def _process_batch(self, batch):
+        raise NotImplementedError
+
+    def _batch_futures(self, batch):
+        """Futures dos itens do lote"""
+        raise NotImplementedError
+
+    def _next_batch(self):
+        """Espera o próximo lote; retorna (itens, encerrar)"""
+        item = self._queue.get()
+        batch = []
+        deadline = None
+        while item is not self._STOP:
+            batch.append(item)
+            if deadline is None:
+                deadline = self._batch_deadline(item)
+            if len(batch) >= self.max_batch_size:
+                return batch, False
+            timeout = deadline - time.perf_counter()
+            try:
+                if timeout > 0:
+                    item = self._queue.get(timeout=timeout)
+                else:
+                    item = self._queue.get_nowait()
+            except queue.Empty:
+                return batch, False
+        return batch, True
+
+    def _run(self):
+        while True:
+            batch, stop = self._next_batch()
+            try:
+                if batch:
+                    self._process_batch(batch)
+            except Exception as e:
+                for future in self._batch_futures(batch):
+                    if not future.done():
+                        future.set_exception(e)
+            finally:
+                for _ in range(len(batch) + stop):
+                    self._queue.task_done()
+            if stop:
+                return
+
+    def flush(self):
+        """Bloqueia até que tudo o que foi enfileirado tenha sido processado"""
+        if self._queue is not None and self._pid == os.getpid():
+            self._queue.join()
+
+    def close(self, timeout=10):
+        """Processa o que restou na fila e encerra a thread"""
+        with self._lock:
+            if self._thread is None or self._pid != os.getpid():
+                return
+            thread = self._thread
+            self._thread = None
+            self._queue.put(self._STOP)
+        thread.join(timeout)
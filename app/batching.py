@@ -0,0 +1,149 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+import numpy as np
+from background import BatchWorker
+from model_utils import INPUT_COLUMNS
+
+# Padrões do agrupamento: até N linhas ou até X ms de espera pela primeira
+MAX_BATCH_SIZE = 64
+MAX_WAIT_MS = 0.5
+
+# Esperas mais recentes guardadas para os percentis de latência
+LATENCY_WINDOW = 10_000
+
+
+def batch_size_buckets(max_batch_size):
+    """Limites superiores do histograma de tamanhos de lote (potências de 2)"""
+    buckets = []
+    size = 1
+    while size < max_batch_size:
+        buckets.append(size)
+        size *= 2
+    buckets.append(max_batch_size)
+    return buckets
+
+
+class PredictionBatcher(BatchWorker):
+    """Agrupa predições concorrentes de uma linha em chamadas vetorizadas
+
+    `submit` responde na hora o que já está no cache ou na tabela de preços;
+    o resto entra em uma fila. Uma thread junta a fila em lotes de até
+    `max_batch_size` linhas, esperando no máximo `max_wait_ms` desde a chegada
+    do primeiro pedido, prevê o lote com uma chamada a `predict_batch` e
+    entrega a cada chamador seu (preço, erro) por um Future. Se o lote
+    anterior teve uma única linha o servidor está ocioso e o pedido é
+    previsto sem esperar a janela.
+    """
+
+    thread_name = "prediction-batcher"
+
+    def __init__(
+        self, car_model, max_batch_size=MAX_BATCH_SIZE, max_wait_ms=MAX_WAIT_MS
+    ):
+        super().__init__(max_batch_size)
+        self.car_model = car_model
+        self.max_wait = max_wait_ms / 1000
+        self._buckets = batch_size_buckets(max_batch_size)
+        # Contadores são atualizados pelas threads das requisições e do lote
+        self._stats_lock = threading.Lock()
+        self._stats = {}
+        self._waits = deque(maxlen=LATENCY_WINDOW)
+        self._last_batch_size = 1
+
+    def _reset_stats(self):
+        with self._stats_lock:
+            self._stats = {
+                "requests": 0,
+                "immediate": 0,
+                "batches": 0,
+                "rows": 0,
+                "total_score_seconds": 0.0,
+                "batch_sizes": dict.fromkeys(self._buckets, 0),
+            }
+            self._waits.clear()
+
+    def submit(self, car):
+        """Enfileira um carro (dicionário com INPUT_COLUMNS); retorna um Future"""
+        self._ensure_started()
+        future = Future()
+        if not self.car_model.model_trained:
+            future.set_result((None, "Modelo não treinado"))
+            return future
+
+        values = tuple(car[col] for col in INPUT_COLUMNS)
+        key, price = self.car_model.lookup_price(*values)
+        with self._stats_lock:
+            self._stats["requests"] += 1
+            if price is not None:
+                self._stats["immediate"] += 1
+        if price is not None:
+            future.set_result((price, None))
+            return future
+
+        self._queue.put((key, values, future, time.perf_counter()))
+        return future
+
+    def predict(self, car, timeout=None):
+        """Versão bloqueante de `submit`; retorna (preço, erro)"""
+        return self.submit(car).result(timeout)
+
+    def _batch_deadline(self, first_item):
+        # A janela conta a partir da chegada do primeiro pedido do lote
+        max_wait = self.max_wait if self._last_batch_size > 1 else 0.0
+        return first_item[3] + max_wait
+
+    def _batch_futures(self, batch):
+        return [future for _, _, future, _ in batch]
+
+    def _process_batch(self, batch):
+        self._last_batch_size = len(batch)
+        start = time.perf_counter()
+        car_columns = {
+            col: [values[i] for _, values, _, _ in batch]
+            for i, col in enumerate(INPUT_COLUMNS)
+        }
+        prices, errors = self.car_model.predict_batch(car_columns, return_errors=True)
+        elapsed = time.perf_counter() - start
+
+        for (key, _, future, _), price, error in zip(batch, prices, errors):
+            if error is not None:
+                future.set_result((None, error))
+                continue
+            if key is not None:
+                self.car_model.prediction_cache.put(key, price)
+            future.set_result((price, None))
+
+        bucket = next(b for b in self._buckets if len(batch) <= b)
+        with self._stats_lock:
+            self._waits.extend(start - enqueued for _, _, _, enqueued in batch)
+            stats = self._stats
+            stats["batches"] += 1
+            stats["rows"] += len(batch)
+            stats["total_score_seconds"] += elapsed
+            stats["batch_sizes"][bucket] += 1
+
+    def metrics(self):
+        """Histograma de tamanhos de lote e latência de espera na fila"""
+        with self._stats_lock:
+            stats = dict(self._stats)
+            stats["batch_sizes"] = dict(stats.get("batch_sizes", {}))
+            waits_ms = np.array(self._waits, dtype=np.float64) * 1000
+        batches = stats.get("batches", 0)
+        if len(waits_ms):
+            p50, p95, p99 = np.percentile(waits_ms, [50, 95, 99])
+            wait = {"p50": p50, "p95": p95, "p99": p99, "max": waits_ms.max()}
+        else:
+            wait = dict.fromkeys(["p50", "p95", "p99", "max"], 0.0)
+        return {
+            "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000,
+            **stats,
+            "avg_batch_size": stats["rows"] / batches if batches else 0.0,
+            "avg_score_ms": (
+                stats["total_score_seconds"] / batches * 1000 if batches else 0.0
+            ),
+            "queue_wait_ms": {name: float(value) for name, value in wait.items()},
+        }
@@ -0,0 +1,582 @@
+import argparse
+import itertools
+import json
+import os
+import platform
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime
+import numpy as np
+import pandas as pd
+import sklearn
+from model_utils import CarPriceModel, INPUT_COLUMNS
+from dataset_cache import build_cache, cache_dir_for, load_dataset
+from database import (
+    INSERT_PREDICTION,
+    get_pool,
+    init_database,
+    load_prediction_history,
+    load_prediction_page,
+    load_prediction_stats,
+    run_with_retry,
+    save_prediction,
+)
+
+# Tamanhos do histórico usados nos benchmarks do SQLite
+HISTORY_SIZES = (1_000, 100_000, 1_000_000)
+
+# Aumento relativo do p50 em relação à base que conta como regressão
+REGRESSION_THRESHOLD = 0.25
+# Aumento absoluto mínimo do p50 para uma regressão; abaixo disso a variação
+# é ruído do escalonador (benchmarks de µs oscilam mais de 25% sozinhos)
+REGRESSION_MIN_SECONDS = 50e-6
+
+# Incrementar quando nomes ou medições do conjunto mudarem; resultados de
+# versões diferentes não são comparados
+SUITE_VERSION = 1
+
+
+def time_it(func, repeat=200, warmup=0):
+    """Executa `func` várias vezes e retorna estatísticas de tempo em segundos
+
+    As `warmup` primeiras execuções não entram na estatística.
+    """
+    for _ in range(warmup):
+        func()
+    timings = np.empty(repeat)
+    for i in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings[i] = time.perf_counter() - start
+    return {
+        "mean": float(timings.mean()),
+        "p50": float(np.percentile(timings, 50)),
+        "p99": float(np.percentile(timings, 99)),
+    }
+
+
+def format_seconds(seconds):
+    """Formata uma duração na unidade mais legível (µs, ms ou s)"""
+    if seconds < 1e-3:
+        return f"{seconds * 1e6:8.1f} µs"
+    if seconds < 1:
+        return f"{seconds * 1e3:8.1f} ms"
+    return f"{seconds:8.2f} s "
+
+
+def print_result(name, stats):
+    """Exibe o resultado de um benchmark"""
+    print(
+        f"{name:<40} média {format_seconds(stats['mean'])} | "
+        f"p50 {format_seconds(stats['p50'])} | p99 {format_seconds(stats['p99'])}"
+    )
+
+
+def encode_legacy(car_model, car_df):
+    """Codificação original com LabelEncoder, get_dummies e reindex"""
+    car_df = car_df.copy()
+    car_df["brand_encoded"] = car_model.le_brand.transform(car_df["brand"])
+    car_df["model_encoded"] = car_model.le_model.transform(car_df["model"])
+    car_df = pd.get_dummies(car_df, columns=["fuel", "gear"], prefix=["fuel", "gear"])
+    car_df = car_df.drop(["brand", "model"], axis=1)
+    final_car_df = car_df.reindex(columns=car_model.X_columns, fill_value=0)
+    return car_model.scaler.transform(final_car_df)
+
+
+def bench_encoding(car_model, sample):
+    """Compara a codificação original com as tabelas de codificação"""
+    single_df = sample.head(1)
+    single_columns = {col: single_df[col].to_numpy() for col in INPUT_COLUMNS}
+    batch_columns = {col: sample[col].to_numpy() for col in INPUT_COLUMNS}
+
+    legacy = encode_legacy(car_model, sample)
+    tables, _, _ = car_model.encode_features(batch_columns)
+    assert np.array_equal(legacy, tables), "Codificações divergentes"
+
+    print_result(
+        "codificação original (1 linha)",
+        time_it(lambda: encode_legacy(car_model, single_df)),
+    )
+    print_result(
+        "tabelas de codificação (1 linha)",
+        time_it(lambda: car_model.encode_features(single_columns)),
+    )
+    print_result(
+        f"codificação original ({len(sample)} linhas)",
+        time_it(lambda: encode_legacy(car_model, sample), repeat=20),
+    )
+    print_result(
+        f"tabelas de codificação ({len(sample)} linhas)",
+        time_it(lambda: car_model.encode_features(batch_columns), repeat=20),
+    )
+
+
+def bench_tree_inference(car_model, sample):
+    """Compara o predict do sklearn com o motor de árvore compilada"""
+    if car_model.compiled_tree is None:
+        print("Modelo não é uma DecisionTreeRegressor, benchmark ignorado")
+        return
+
+    batch_columns = {col: sample[col].to_numpy() for col in INPUT_COLUMNS}
+    X, _, _ = car_model.encode_features(batch_columns)
+    single = X[:1]
+    tree = car_model.compiled_tree
+
+    assert np.array_equal(car_model.model.predict(X), tree.predict(X))
+    assert np.array_equal(car_model.model.predict(single), tree.predict(single))
+
+    print(f"Nós na árvore: {tree.node_count}")
+    for n_rows in (1, 100, len(X)):
+        X_part = X[:n_rows]
+        repeat = 200 if n_rows <= 100 else 20
+        print_result(
+            f"sklearn predict ({n_rows} linhas)",
+            time_it(lambda: car_model.model.predict(X_part), repeat=repeat),
+        )
+        print_result(
+            f"árvore compilada ({n_rows} linhas)",
+            time_it(lambda: tree.predict(X_part), repeat=repeat),
+        )
+
+
+def bench_artifact_load(car_model):
+    """Compara o tempo de carga do pickle antigo com o diretório versionado"""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for name in ("car_price_model.pkl", "car_price_model"):
+            path = os.path.join(tmpdir, name)
+            car_model.save_model(path)
+            print_result(
+                f"load_model ({name})",
+                time_it(lambda: CarPriceModel().load_model(path), repeat=10),
+            )
+
+
+def bench_catalog(car_model):
+    """Mostra que as consultas ao catálogo não dependem do tamanho da marca"""
+    counts = {
+        brand: car_model.count_models_by_brand(brand)
+        for brand in car_model.get_unique_values()["brands"]
+    }
+    smallest = min(counts, key=counts.get)
+    largest = max(counts, key=counts.get)
+
+    print_result(
+        "máscara no DataFrame (maior marca)",
+        time_it(
+            lambda: sorted(
+                car_model.df[car_model.df["brand"] == largest]["model"].unique()
+            ),
+            repeat=50,
+        ),
+    )
+    for brand in (smallest, largest):
+        print_result(
+            f"get_models_by_brand ({counts[brand]} modelos)",
+            time_it(lambda: car_model.get_models_by_brand(brand), repeat=10000),
+        )
+    print_result(
+        "get_unique_values",
+        time_it(car_model.get_unique_values, repeat=10000),
+    )
+
+
+def directory_size(path):
+    """Soma o tamanho dos arquivos de um diretório (ou de um único arquivo)"""
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    return sum(entry.stat().st_size for entry in os.scandir(path))
+
+
+def bench_estimators(
+    csv_path, sample, estimators=("tree", "hist_gradient_boosting_categorical")
+):
+    """Compara estimadores em treino, artefato, latência, vazão e MAE
+
+    Todos usam a mesma divisão treino/teste (mesmas linhas e random_state).
+    """
+    single_columns = {col: sample[col].to_numpy()[:1] for col in INPUT_COLUMNS}
+    batch_columns = {col: sample[col].to_numpy() for col in INPUT_COLUMNS}
+    for name in estimators:
+        car_model = CarPriceModel()
+        car_model.load_and_preprocess_data(csv_path)
+        car_model.train_model(name, use_feature_store=False)
+        info = car_model.training_info
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "car_price_model")
+            car_model.save_model(path)
+            artifact_mb = directory_size(path) / 1e6
+
+        latency = time_it(lambda: car_model.predict_batch(single_columns))
+        batch = time_it(lambda: car_model.predict_batch(batch_columns), repeat=10)
+        print(
+            f"{name:<36} treino {info['fit_seconds']:6.2f}s | "
+            f"artefato {artifact_mb:7.2f} MB | "
+            f"1 linha p50 {latency['p50'] * 1e6:8.1f} µs | "
+            f"{len(sample) / batch['mean']:10,.0f} linhas/s | "
+            f"MAE teste R$ {info['test_mae']:,.2f}"
+        )
+
+
+def bench_compaction(car_model, sample):
+    """Compacta a árvore e compara predições e tempo de inferência"""
+    if car_model.compiled_tree is None:
+        print("Modelo não é uma DecisionTreeRegressor, benchmark ignorado")
+        return
+
+    batch_columns = {col: sample[col].to_numpy() for col in INPUT_COLUMNS}
+    X, _, _ = car_model.encode_features(batch_columns)
+    full_tree = car_model.compiled_tree
+    car_model.compact_model()
+    compact_tree = car_model.compiled_tree
+    assert np.array_equal(full_tree.predict(X), compact_tree.predict(X))
+
+    for n_rows in (1, len(X)):
+        X_part = X[:n_rows]
+        repeat = 200 if n_rows == 1 else 20
+        for name, tree in (
+            ("árvore completa", full_tree),
+            ("árvore compacta", compact_tree),
+        ):
+            print_result(
+                f"{name} ({n_rows} linhas)",
+                time_it(lambda: tree.predict(X_part), repeat=repeat),
+            )
+
+
+def make_scaled_csv(csv_path, factor, dest_path):
+    """Grava uma cópia do CSV com `factor` vezes mais linhas distintas"""
+    df = pd.read_csv(csv_path, encoding="latin1")
+    copies = []
+    for i in range(factor):
+        copy = df.copy()
+        copy["authentication"] = copy["authentication"].astype(str) + f"-{i}"
+        copies.append(copy)
+    pd.concat(copies).to_csv(dest_path, index=False, encoding="latin1")
+
+
+def bench_dataset_load(csv_path, factors=(1, 10)):
+    """Compara a leitura do CSV com o cache colunar em 1x e 10x o dataset"""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for factor in factors:
+            path = os.path.join(tmpdir, f"fipe_cars_x{factor}.csv")
+            make_scaled_csv(csv_path, factor, path)
+            size_mb = os.path.getsize(path) / 1e6
+
+            start = time.perf_counter()
+            pd.read_csv(path, encoding="latin1").drop_duplicates()
+            csv_seconds = time.perf_counter() - start
+
+            start = time.perf_counter()
+            build_cache(path)
+            build_seconds = time.perf_counter() - start
+
+            start = time.perf_counter()
+            load_dataset(path)
+            cached_seconds = time.perf_counter() - start
+
+            start = time.perf_counter()
+            load_dataset(path, columns=INPUT_COLUMNS)
+            columns_seconds = time.perf_counter() - start
+
+            cache_mb = directory_size(cache_dir_for(path)) / 1e6
+            print(
+                f"{factor:>3}x ({size_mb:.0f} MB CSV, {cache_mb:.0f} MB cache): "
+                f"CSV {csv_seconds:.2f}s | montar cache {build_seconds:.2f}s | "
+                f"cache {cached_seconds:.3f}s | "
+                f"cache só entradas {columns_seconds:.3f}s"
+            )
+
+
+def bench_memory(csv_path):
+    """Compara a memória do DataFrame completo com o modo compacto"""
+    full_model = CarPriceModel()
+    full_model.load_and_preprocess_data(csv_path, use_cache=False)
+    compact_model = CarPriceModel()
+    compact_model.load_and_preprocess_data(csv_path, compact=True)
+
+    before = full_model.df.memory_usage(deep=True)
+    after = compact_model.df.memory_usage(deep=True)
+    for col in before.index.drop("Index"):
+        after_mb = f"{after[col] / 1e6:8.2f} MB" if col in after else "   (removida)"
+        print(
+            f"{col:<20} {str(full_model.df[col].dtype):>10} {before[col] / 1e6:8.2f} MB"
+            f" -> {str(compact_model.df[col].dtype) if col in after else '':>10}"
+            f" {after_mb}"
+        )
+    print(
+        f"{'total':<20} {'':>10} {before.sum() / 1e6:8.2f} MB -> {'':>10}"
+        f" {after.sum() / 1e6:8.2f} MB"
+    )
+
+
+def run_comparisons(csv_path="app/dataset/fipe_cars.csv", sample_size=10000):
+    """Comparativos entre as implementações antigas e as otimizadas"""
+    print("--- Carga do dataset ---")
+    bench_dataset_load(csv_path)
+
+    car_model = CarPriceModel()
+    if not car_model.load_and_preprocess_data(csv_path):
+        return False
+    car_model.train_model()
+
+    sample = car_model.df[INPUT_COLUMNS].sample(
+        min(sample_size, len(car_model.df)), random_state=42
+    )
+
+    print("\n--- Memória do DataFrame ---")
+    bench_memory(csv_path)
+
+    print("\n--- Codificação de features ---")
+    bench_encoding(car_model, sample)
+
+    print("\n--- Inferência da árvore ---")
+    bench_tree_inference(car_model, sample)
+
+    print("\n--- Consultas ao catálogo ---")
+    bench_catalog(car_model)
+
+    print("\n--- Carga do artefato ---")
+    bench_artifact_load(car_model)
+
+    print("\n--- Compactação da árvore ---")
+    bench_compaction(car_model, sample)
+
+    print("\n--- Estimadores ---")
+    bench_estimators(csv_path, sample)
+    return True
+
+
+def make_history_rows(n_rows, sample, seed=42):
+    """Gera `n_rows` predições salvas a partir de carros da amostra"""
+    rng = np.random.default_rng(seed)
+    cars = sample.iloc[rng.integers(0, len(sample), n_rows)]
+    seconds = pd.to_timedelta(rng.integers(0, 365 * 86400, n_rows), unit="s")
+    timestamps = (pd.Timestamp("2024-01-01") + seconds).strftime("%Y-%m-%dT%H:%M:%S")
+    prices = rng.uniform(10_000, 300_000, n_rows).round(2)
+    is_good = rng.random(n_rows) < 0.7
+    corrected = np.where(is_good, np.nan, (prices * rng.uniform(0.8, 1.2)).round(2))
+    return list(
+        zip(
+            timestamps.tolist(),
+            cars["year_of_reference"].astype(int).tolist(),
+            cars["brand"].astype(str).tolist(),
+            cars["model"].astype(str).tolist(),
+            cars["fuel"].astype(str).tolist(),
+            cars["gear"].astype(str).tolist(),
+            cars["engine_size"].astype(float).tolist(),
+            cars["year_model"].astype(int).tolist(),
+            prices.tolist(),
+            is_good.tolist(),
+            [None if np.isnan(price) else price for price in corrected],
+            [None] * n_rows,
+        )
+    )
+
+
+def bench_history(sample, history_sizes=HISTORY_SIZES):
+    """Mede gravação e leitura do histórico com bancos de tamanhos diferentes"""
+    results = {}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for n_rows in history_sizes:
+            path = os.path.join(tmpdir, f"history_{n_rows}.db")
+            init_database(path)
+            rows = make_history_rows(n_rows, sample)
+
+            def insert_many(conn):
+                with conn:
+                    conn.executemany(INSERT_PREDICTION, rows)
+
+            run_with_retry(insert_many, path)
+            new_row = rows[0]
+            load_repeat = 3 if n_rows >= 1_000_000 else 10
+            for name, func, repeat in (
+                ("save_prediction", lambda: save_prediction(new_row, path), 200),
+                (
+                    "load_prediction_history",
+                    lambda: load_prediction_history(path),
+                    load_repeat,
+                ),
+                ("load_prediction_page", lambda: load_prediction_page(path=path), 200),
+                ("load_prediction_stats", lambda: load_prediction_stats(path), 200),
+            ):
+                results[f"sqlite/{name}/{n_rows}"] = time_it(
+                    func, repeat=repeat, warmup=1
+                )
+            get_pool(path).close()
+    return results
+
+
+def bench_model_paths(csv_path, sample):
+    """Mede carga de dados, treino, artefato, predição e catálogo"""
+    results = {}
+    car_model = CarPriceModel()
+    # A primeira carga monta o cache colunar; as medidas usam o cache pronto
+    results["model/load_and_preprocess_data"] = time_it(
+        lambda: car_model.load_and_preprocess_data(csv_path), repeat=5, warmup=1
+    )
+    results["model/train_model"] = time_it(
+        lambda: car_model.train_model("tree", use_feature_store=False), repeat=3
+    )
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, "car_price_model")
+        results["model/save_model"] = time_it(
+            lambda: car_model.save_model(path), repeat=5, warmup=1
+        )
+        results["model/load_model"] = time_it(
+            lambda: CarPriceModel().load_model(path), repeat=10, warmup=1
+        )
+
+    # Sem cache nem tabela de preços: cada chamada passa pelo modelo
+    car_model.prediction_cache.max_size = 0
+    car_model.lookup_table = None
+    cars = itertools.cycle(sample[INPUT_COLUMNS].itertuples(index=False))
+    results["predict/predict_price"] = time_it(
+        lambda: car_model.predict_price(*next(cars)), repeat=1000, warmup=10
+    )
+
+    batch_columns = {col: sample[col].to_numpy() for col in INPUT_COLUMNS}
+    stats = time_it(lambda: car_model.predict_batch(batch_columns), repeat=10, warmup=1)
+    results["predict/predict_batch"] = {
+        **stats,
+        "rows": len(sample),
+        "rows_per_second": len(sample) / stats["p50"],
+    }
+
+    brands = car_model.get_unique_values()["brands"]
+    largest = max(brands, key=car_model.count_models_by_brand)
+    results["catalog/get_models_by_brand"] = time_it(
+        lambda: car_model.get_models_by_brand(largest), repeat=10000
+    )
+    return results, len(car_model.df)
+
+
+def run_suite(
+    csv_path="app/dataset/fipe_cars.csv",
+    sample_size=10000,
+    history_sizes=HISTORY_SIZES,
+):
+    """Executa o conjunto de benchmarks e retorna o resultado serializável"""
+    dataset = pd.read_csv(csv_path, encoding="latin1", usecols=INPUT_COLUMNS)
+    sample = dataset.dropna().sample(min(sample_size, len(dataset)), random_state=42)
+
+    print("--- Modelo ---")
+    results, dataset_rows = bench_model_paths(csv_path, sample)
+    print("--- SQLite ---")
+    results.update(bench_history(sample, history_sizes))
+    for name, stats in results.items():
+        print_result(name, stats)
+
+    return {
+        "meta": {
+            "suite_version": SUITE_VERSION,
+            "created_at": datetime.now().isoformat(timespec="seconds"),
+            "platform": platform.platform(),
+            "machine": platform.machine(),
+            "cpu_count": os.cpu_count(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "pandas": pd.__version__,
+            "sklearn": sklearn.__version__,
+            "sqlite": sqlite3.sqlite_version,
+            "dataset_rows": dataset_rows,
+            "sample_size": len(sample),
+        },
+        "results": results,
+    }
+
+
+def compare_results(
+    current,
+    baseline,
+    threshold=REGRESSION_THRESHOLD,
+    min_seconds=REGRESSION_MIN_SECONDS,
+):
+    """Compara o p50 de cada benchmark com a base; retorna as regressões
+
+    Uma regressão precisa passar da variação relativa `threshold` e também
+    aumentar o p50 em mais de `min_seconds`.
+    """
+    if baseline["meta"].get("suite_version") != SUITE_VERSION:
+        print("Base gerada por outra versão do conjunto, comparação ignorada.")
+        return []
+    for key in ("machine", "cpu_count", "python"):
+        if baseline["meta"].get(key) != current["meta"].get(key):
+            print(
+                f"Aviso: '{key}' difere da base "
+                f"({baseline['meta'].get(key)} -> {current['meta'].get(key)})"
+            )
+
+    regressions = []
+    print(f"\n{'benchmark':<44} {'base p50':>11}  {'atual p50':>11}  variação")
+    for name, stats in current["results"].items():
+        base = baseline["results"].get(name)
+        if base is None:
+            print(f"{name:<44} {'(novo)':>11}  {format_seconds(stats['p50'])}")
+            continue
+        change = stats["p50"] / base["p50"] - 1
+        regressed = change > threshold and stats["p50"] - base["p50"] > min_seconds
+        if regressed:
+            regressions.append(name)
+        print(
+            f"{name:<44} {format_seconds(base['p50'])}  "
+            f"{format_seconds(stats['p50'])}  {change:+8.1%}"
+            f"{'  REGRESSÃO' if regressed else ''}"
+        )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks do modelo e da aplicação")
+    parser.add_argument("--csv", default="app/dataset/fipe_cars.csv")
+    parser.add_argument("--sample-size", type=int, default=10000)
+    commands = parser.add_subparsers(dest="command")
+    commands.add_parser("compare", help="Comparativos de otimizações (padrão)")
+    suite = commands.add_parser("suite", help="Conjunto reproduzível com saída JSON")
+    suite.add_argument("--output", default="benchmark_results.json")
+    suite.add_argument("--baseline", help="JSON de uma execução anterior")
+    suite.add_argument(
+        "--threshold",
+        type=float,
+        default=REGRESSION_THRESHOLD,
+        help="Aumento relativo do p50 tolerado (0.25 = 25%%)",
+    )
+    suite.add_argument(
+        "--min-delta-us",
+        type=float,
+        default=REGRESSION_MIN_SECONDS * 1e6,
+        help="Aumento absoluto do p50 abaixo do qual a variação é ruído",
+    )
+    suite.add_argument(
+        "--history-sizes", type=int, nargs="+", default=list(HISTORY_SIZES)
+    )
+    args = parser.parse_args()
+
+    if args.command != "suite":
+        return run_comparisons(args.csv, args.sample_size)
+
+    current = run_suite(args.csv, args.sample_size, args.history_sizes)
+    with open(args.output, "w") as f:
+        json.dump(current, f, indent=2)
+    print(f"\nResultados salvos em '{args.output}'.")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare_results(
+            current, baseline, args.threshold, args.min_delta_us / 1e6
+        )
+        if regressions:
+            print(
+                f"\n{len(regressions)} regressão(ões) acima de {args.threshold:.0%}: "
+                f"{', '.join(regressions)}"
+            )
+            return False
+    return True
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
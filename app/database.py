@@ -0,0 +1,531 @@
+import atexit
+import os
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import contextmanager
+import pandas as pd
+from background import BatchWorker
+
+DATABASE_PATH = "car_predictions.db"
+
+# Espera do SQLite por um lock antes de desistir (ms)
+BUSY_TIMEOUT_MS = 5000
+# Novas tentativas quando o lock ainda assim não é obtido
+LOCK_RETRIES = 5
+LOCK_RETRY_DELAY = 0.05
+# Conexões ociosas mantidas por processo
+POOL_SIZE = 4
+
+# Escrita em segundo plano: um lote é gravado ao atingir WRITE_BATCH_SIZE
+# registros ou WRITE_FLUSH_INTERVAL segundos após o primeiro da fila
+WRITE_BATCH_SIZE = 100
+WRITE_FLUSH_INTERVAL = 0.5
+
+INSERT_PREDICTION = """
+INSERT INTO predictions (
+    timestamp, year_of_reference, brand, model, fuel, gear,
+    engine_size, year_model, predicted_price, is_good_prediction,
+    user_corrected_price, user_comments
+) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+
+def _optional(convert):
+    return lambda value: None if value is None else convert(value)
+
+
+# Conversão de cada campo de INSERT_PREDICTION; tipos do NumPy (vindos do
+# DataFrame ou dos widgets) não podem ser passados ao sqlite3
+PREDICTION_FIELDS = [
+    ("timestamp", str),
+    ("year_of_reference", int),
+    ("brand", str),
+    ("model", str),
+    ("fuel", str),
+    ("gear", str),
+    ("engine_size", float),
+    ("year_model", int),
+    ("predicted_price", float),
+    ("is_good_prediction", bool),
+    ("user_corrected_price", _optional(float)),
+    ("user_comments", _optional(str)),
+]
+
+
+def coerce_prediction(prediction_data):
+    """Valida um registro de predição e converte os campos para tipos do SQLite
+
+    Levanta ValueError se o número de campos ou algum valor for inválido.
+    """
+    prediction_data = tuple(prediction_data)
+    if len(prediction_data) != len(PREDICTION_FIELDS):
+        raise ValueError(
+            f"Esperados {len(PREDICTION_FIELDS)} campos, "
+            f"recebidos {len(prediction_data)}"
+        )
+    row = []
+    for (name, convert), value in zip(PREDICTION_FIELDS, prediction_data):
+        try:
+            row.append(convert(value))
+        except (TypeError, ValueError):
+            raise ValueError(f"Valor inválido para {name}: {value!r}")
+    return tuple(row)
+
+
+# Linhas por página na tela de histórico
+HISTORY_PAGE_SIZE = 50
+HISTORY_COLUMNS = [
+    "id",
+    "timestamp",
+    "brand",
+    "model",
+    "year_model",
+    "predicted_price",
+    "is_good_prediction",
+    "user_corrected_price",
+    "user_comments",
+]
+
+# Índices da paginação e dos filtros do histórico. O id (rowid) já fica no
+# fim de todo índice, então cada um entrega as linhas em (timestamp, id).
+HISTORY_INDEXES = """
+CREATE INDEX IF NOT EXISTS idx_predictions_timestamp
+    ON predictions (timestamp);
+CREATE INDEX IF NOT EXISTS idx_predictions_brand_timestamp
+    ON predictions (brand, timestamp);
+CREATE INDEX IF NOT EXISTS idx_predictions_brand_model_timestamp
+    ON predictions (brand, model, timestamp);
+CREATE INDEX IF NOT EXISTS idx_predictions_rating_timestamp
+    ON predictions (is_good_prediction, timestamp);
+"""
+
+# Agregados do histórico mantidos por triggers em uma única linha de
+# prediction_stats, para que as métricas não varram a tabela a cada rerun
+STATS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS prediction_stats (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    total INTEGER NOT NULL,
+    good_count INTEGER NOT NULL,
+    price_count INTEGER NOT NULL,
+    price_sum REAL NOT NULL,
+    corrected_count INTEGER NOT NULL
+);
+
+INSERT OR IGNORE INTO prediction_stats
+SELECT 1,
+       COUNT(*),
+       COALESCE(SUM(is_good_prediction = 1), 0),
+       COUNT(predicted_price),
+       COALESCE(SUM(predicted_price), 0),
+       COUNT(user_corrected_price)
+FROM predictions;
+
+CREATE TRIGGER IF NOT EXISTS prediction_stats_insert
+AFTER INSERT ON predictions
+BEGIN
+    UPDATE prediction_stats SET
+        total = total + 1,
+        good_count = good_count + (NEW.is_good_prediction = 1),
+        price_count = price_count + (NEW.predicted_price IS NOT NULL),
+        price_sum = price_sum + COALESCE(NEW.predicted_price, 0),
+        corrected_count = corrected_count + (NEW.user_corrected_price IS NOT NULL)
+    WHERE id = 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS prediction_stats_delete
+AFTER DELETE ON predictions
+BEGIN
+    UPDATE prediction_stats SET
+        total = total - 1,
+        good_count = good_count - (OLD.is_good_prediction = 1),
+        price_count = price_count - (OLD.predicted_price IS NOT NULL),
+        price_sum = price_sum - COALESCE(OLD.predicted_price, 0),
+        corrected_count = corrected_count - (OLD.user_corrected_price IS NOT NULL)
+    WHERE id = 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS prediction_stats_update
+AFTER UPDATE ON predictions
+BEGIN
+    UPDATE prediction_stats SET
+        good_count = good_count
+            - (OLD.is_good_prediction = 1) + (NEW.is_good_prediction = 1),
+        price_count = price_count
+            - (OLD.predicted_price IS NOT NULL) + (NEW.predicted_price IS NOT NULL),
+        price_sum = price_sum
+            - COALESCE(OLD.predicted_price, 0) + COALESCE(NEW.predicted_price, 0),
+        corrected_count = corrected_count
+            - (OLD.user_corrected_price IS NOT NULL)
+            + (NEW.user_corrected_price IS NOT NULL)
+    WHERE id = 1;
+END;
+"""
+
+
+class ConnectionPool:
+    """Conexões SQLite reaproveitadas entre chamadas e threads do processo
+
+    O Streamlit executa cada rerun em uma thread nova, então um cache por
+    thread não sobreviveria entre reruns; o pool guarda conexões ociosas e as
+    entrega a qualquer thread. Cada conexão é aberta uma vez com WAL,
+    synchronous=NORMAL e busy_timeout. Depois de um fork, o processo filho
+    descarta as conexões herdadas e abre as suas.
+    """
+
+    def __init__(self, path=DATABASE_PATH, max_idle=POOL_SIZE):
+        self.path = path
+        self.max_idle = max_idle
+        self._idle = queue.LifoQueue()
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        conn = sqlite3.connect(
+            self.path, timeout=BUSY_TIMEOUT_MS / 1000, check_same_thread=False
+        )
+        # Em WAL leitores não bloqueiam o escritor (e vice-versa); com NORMAL
+        # o commit não faz fsync, só o checkpoint
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+        return conn
+
+    def _check_fork(self):
+        with self._lock:
+            if self._pid != os.getpid():
+                # Conexões herdadas do processo pai não podem ser usadas
+                self._idle = queue.LifoQueue()
+                self._pid = os.getpid()
+
+    @contextmanager
+    def connection(self):
+        """Empresta uma conexão do pool e a devolve ao final do bloco"""
+        self._check_fork()
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            conn = self._connect()
+
+        try:
+            yield conn
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            if self._idle.qsize() < self.max_idle:
+                self._idle.put(conn)
+            else:
+                conn.close()
+
+    def close(self):
+        """Fecha as conexões ociosas"""
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(path=DATABASE_PATH):
+    """Retorna o pool de conexões do banco em `path` (um por processo)"""
+    with _pools_lock:
+        if path not in _pools:
+            _pools[path] = ConnectionPool(path)
+        return _pools[path]
+
+
+def is_lock_error(error):
+    """Indica se o erro do SQLite é de contenção de lock"""
+    message = str(error).lower()
+    return "locked" in message or "busy" in message
+
+
+def run_with_retry(operation, path=DATABASE_PATH, retries=LOCK_RETRIES):
+    """Executa `operation(conn)` repetindo com espera crescente se o banco
+    continuar travado depois do busy_timeout"""
+    for attempt in range(retries + 1):
+        try:
+            with get_pool(path).connection() as conn:
+                return operation(conn)
+        except sqlite3.OperationalError as e:
+            if not is_lock_error(e) or attempt == retries:
+                raise
+            time.sleep(LOCK_RETRY_DELAY * 2**attempt)
+
+
+# Função para inicializar o banco de dados
+def init_database(path=DATABASE_PATH):
+    """Inicializa o banco de dados SQLite"""
+
+    def create_tables(conn):
+        # O esquema é criado em uma única transação; com a linha de agregados
+        # presente ele está completo e o rerun não refaz o preenchimento
+        # inicial, que varre a tabela inteira segurando o lock de escrita
+        try:
+            if conn.execute("SELECT 1 FROM prediction_stats WHERE id = 1").fetchone():
+                return
+        except sqlite3.OperationalError as e:
+            # Sem a tabela de agregados o banco ainda não foi inicializado
+            if is_lock_error(e):
+                raise
+
+        # executescript faz commit do que estiver pendente; o BEGIN explícito
+        # garante que o preenchimento inicial e os triggers entram juntos
+        conn.executescript(
+            """
+            BEGIN IMMEDIATE;
+            CREATE TABLE IF NOT EXISTS predictions (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                timestamp TEXT,
+                year_of_reference INTEGER,
+                brand TEXT,
+                model TEXT,
+                fuel TEXT,
+                gear TEXT,
+                engine_size REAL,
+                year_model INTEGER,
+                predicted_price REAL,
+                is_good_prediction BOOLEAN,
+                user_corrected_price REAL,
+                user_comments TEXT
+            );
+            """
+            + HISTORY_INDEXES
+            + STATS_SCHEMA
+            + "COMMIT;"
+        )
+
+    run_with_retry(create_tables, path)
+
+
+# Função para salvar predição no banco
+def save_prediction(prediction_data, path=DATABASE_PATH):
+    """Salva a predição no banco de dados"""
+
+    def insert(conn):
+        with conn:
+            conn.execute(INSERT_PREDICTION, prediction_data)
+
+    run_with_retry(insert, path)
+
+
+class PredictionWriter(BatchWorker):
+    """Grava predições em segundo plano, em lotes com executemany
+
+    `put` valida e enfileira o registro e retorna um Future que só é
+    resolvido depois do commit; uma thread agrupa a fila em lotes (por
+    tamanho ou janela de tempo) e grava cada lote em uma única transação.
+    Se o lote falhar, os registros são gravados um a um e só os que falharem
+    de novo recebem a exceção. Na saída do processo a fila é esvaziada antes
+    de encerrar.
+    """
+
+    thread_name = "prediction-writer"
+
+    def __init__(
+        self,
+        path=DATABASE_PATH,
+        batch_size=WRITE_BATCH_SIZE,
+        flush_interval=WRITE_FLUSH_INTERVAL,
+    ):
+        super().__init__(batch_size)
+        self.path = path
+        self.flush_interval = flush_interval
+        self._stats = {}
+        atexit.register(self.close)
+
+    @property
+    def batch_size(self):
+        return self.max_batch_size
+
+    def _reset_stats(self):
+        self._stats = {
+            "batches": 0,
+            "rows": 0,
+            "failed_rows": 0,
+            "last_flush_seconds": 0.0,
+            "max_flush_seconds": 0.0,
+            "total_flush_seconds": 0.0,
+        }
+
+    def put(self, prediction_data):
+        """Enfileira uma predição para gravação; retorna um Future
+
+        Registros inválidos levantam ValueError aqui, no chamador.
+        """
+        row = coerce_prediction(prediction_data)
+        self._ensure_started()
+        future = Future()
+        self._queue.put((row, future))
+        return future
+
+    def _batch_deadline(self, first_item):
+        # A janela conta a partir do momento em que o primeiro registro sai da fila
+        return time.perf_counter() + self.flush_interval
+
+    def _batch_futures(self, batch):
+        return [future for _, future in batch]
+
+    def _process_batch(self, batch):
+        def insert_many(rows):
+            def insert(conn):
+                with conn:
+                    conn.executemany(INSERT_PREDICTION, rows)
+
+            run_with_retry(insert, self.path)
+
+        start = time.perf_counter()
+        written = 0
+        try:
+            insert_many([row for row, _ in batch])
+            written = len(batch)
+            for _, future in batch:
+                future.set_result(True)
+        except sqlite3.Error as e:
+            # Um registro ruim não pode derrubar o lote inteiro
+            print(f"Erro ao gravar lote de {len(batch)} predições: {e}")
+            for row, future in batch:
+                try:
+                    insert_many([row])
+                except sqlite3.Error as e:
+                    print(f"Erro ao gravar predição {row}: {e}")
+                    self._stats["failed_rows"] += 1
+                    future.set_exception(e)
+                else:
+                    written += 1
+                    future.set_result(True)
+        elapsed = time.perf_counter() - start
+
+        stats = self._stats
+        stats["batches"] += 1
+        stats["rows"] += written
+        stats["last_flush_seconds"] = elapsed
+        stats["max_flush_seconds"] = max(stats["max_flush_seconds"], elapsed)
+        stats["total_flush_seconds"] += elapsed
+
+    def metrics(self):
+        """Profundidade da fila e latência dos lotes gravados"""
+        stats = dict(self._stats)
+        batches = stats.get("batches", 0)
+        return {
+            "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+            **stats,
+            "avg_flush_seconds": (
+                stats["total_flush_seconds"] / batches if batches else 0.0
+            ),
+        }
+
+
+_writers = {}
+
+
+def get_writer(path=DATABASE_PATH):
+    """Retorna o gravador em segundo plano do banco em `path`"""
+    with _pools_lock:
+        if path not in _writers:
+            _writers[path] = PredictionWriter(path)
+        return _writers[path]
+
+
+def save_prediction_async(prediction_data, path=DATABASE_PATH):
+    """Enfileira a predição para gravação em lote, sem esperar o disco
+
+    Retorna um Future resolvido quando o registro for gravado (ou com a
+    exceção, se a gravação falhar).
+    """
+    return get_writer(path).put(prediction_data)
+
+
+# Função para carregar as estatísticas do histórico
+def load_prediction_stats(path=DATABASE_PATH):
+    """Carrega os agregados do histórico (uma única linha, custo constante)
+
+    Retorna total de predições, predições boas, taxa de acerto (%), preço
+    médio previsto e número de correções de usuário.
+    """
+    row = run_with_retry(
+        lambda conn: conn.execute(
+            "SELECT total, good_count, price_count, price_sum, corrected_count "
+            "FROM prediction_stats WHERE id = 1"
+        ).fetchone(),
+        path,
+    )
+    total, good_count, price_count, price_sum, corrected_count = row or (0,) * 5
+    return {
+        "total": total,
+        "good_count": good_count,
+        "accuracy_pct": good_count / total * 100 if total else 0.0,
+        "avg_predicted_price": price_sum / price_count if price_count else 0.0,
+        "corrected_count": corrected_count,
+    }
+
+
+# Função para carregar uma página do histórico
+def load_prediction_page(
+    after=None,
+    page_size=HISTORY_PAGE_SIZE,
+    brand=None,
+    model=None,
+    start_date=None,
+    end_date=None,
+    is_good=None,
+    path=DATABASE_PATH,
+):
+    """Carrega uma página do histórico, da predição mais recente para a mais antiga
+
+    Paginação por chave: `after` é o cursor (timestamp, id) da última linha da
+    página anterior, então qualquer página custa uma busca no índice, por mais
+    antiga que seja. Os filtros vão para o WHERE (None = sem filtro);
+    `start_date` é inclusivo e `end_date` exclusivo. Retorna o DataFrame da
+    página e o cursor da próxima (None na última página).
+    """
+    conditions = []
+    params = []
+    for condition, value in (
+        ("brand = ?", brand),
+        ("model = ?", model),
+        ("timestamp >= ?", start_date and str(start_date)),
+        ("timestamp < ?", end_date and str(end_date)),
+        ("is_good_prediction = ?", None if is_good is None else int(is_good)),
+    ):
+        if value is not None:
+            conditions.append(condition)
+            params.append(value)
+    if after is not None:
+        conditions.append("(timestamp, id) < (?, ?)")
+        params.extend(after)
+
+    where = " AND ".join(conditions) or "1"
+    query = (
+        f"SELECT {', '.join(HISTORY_COLUMNS)} FROM predictions WHERE {where} "
+        "ORDER BY timestamp DESC, id DESC LIMIT ?"
+    )
+    # Uma linha a mais indica se existe próxima página
+    params.append(page_size + 1)
+    page = run_with_retry(
+        lambda conn: pd.read_sql_query(query, conn, params=params), path
+    )
+
+    next_cursor = None
+    if len(page) > page_size:
+        page = page.iloc[:page_size]
+        next_cursor = (page["timestamp"].iloc[-1], int(page["id"].iloc[-1]))
+    return page, next_cursor
+
+
+# Função para carregar histórico de predições
+def load_prediction_history(path=DATABASE_PATH):
+    """Carrega o histórico de predições"""
+    return run_with_retry(
+        lambda conn: pd.read_sql_query(
+            "SELECT * FROM predictions ORDER BY timestamp DESC", conn
+        ),
+        path,
+    )
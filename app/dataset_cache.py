@@ -0,0 +1,159 @@
+import hashlib
+import json
+import os
+import tempfile
+import numpy as np
+import pandas as pd
+from storage import publish_dir
+
+# Incrementar quando o formato do cache mudar
+CACHE_VERSION = 1
+CACHE_META = "meta.json"
+
+
+def cache_dir_for(csv_path):
+    """Diretório do cache colunar de um CSV (ao lado do arquivo original)"""
+    return os.path.splitext(csv_path)[0] + ".cache"
+
+
+def file_sha256(path, chunk_size=1 << 20):
+    """Calcula o hash SHA-256 do conteúdo de um arquivo"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _read_meta(cache_dir):
+    meta_path = os.path.join(cache_dir, CACHE_META)
+    if not os.path.exists(meta_path):
+        return None
+    with open(meta_path) as f:
+        meta = json.load(f)
+    if meta.get("cache_version") != CACHE_VERSION:
+        return None
+    return meta
+
+
+def _write_meta(cache_dir, meta):
+    with open(os.path.join(cache_dir, CACHE_META), "w") as f:
+        json.dump(meta, f, indent=2)
+
+
+def _is_valid(meta, csv_path, cache_dir):
+    """Confere se o cache corresponde ao CSV atual
+
+    Tamanho e mtime iguais bastam. Se só o mtime mudou (arquivo copiado ou
+    tocado), o hash do conteúdo decide e o mtime é atualizado no cache.
+    """
+    if meta is None:
+        return False
+    stat = os.stat(csv_path)
+    source = meta["source"]
+    if source["size"] != stat.st_size:
+        return False
+    if source["mtime_ns"] == stat.st_mtime_ns:
+        return True
+    if source["sha256"] != file_sha256(csv_path):
+        return False
+    source["mtime_ns"] = stat.st_mtime_ns
+    _write_meta(cache_dir, meta)
+    return True
+
+
+def build_cache(csv_path, cache_dir=None, encoding="latin1"):
+    """Converte o CSV para o cache colunar binário
+
+    Remove linhas duplicadas, grava colunas de texto como categorias (códigos
+    + categorias ordenadas) e colunas numéricas com o tipo original.
+    """
+    cache_dir = cache_dir or cache_dir_for(csv_path)
+    stat = os.stat(csv_path)
+    sha256 = file_sha256(csv_path)
+
+    df = pd.read_csv(csv_path, encoding=encoding)
+    n_rows_raw = len(df)
+    df = df.drop_duplicates()
+
+    parent = os.path.dirname(os.path.abspath(cache_dir))
+    tmp_dir = tempfile.mkdtemp(prefix=".cache-", dir=parent)
+    columns = []
+    for name in df.columns:
+        series = df[name]
+        if pd.api.types.is_numeric_dtype(series):
+            np.save(os.path.join(tmp_dir, f"{name}.npy"), series.to_numpy())
+            columns.append({"name": name, "kind": "numeric"})
+            continue
+
+        categories = np.array(sorted(series.dropna().unique()), dtype=str)
+        codes = pd.Categorical(series, categories=categories).codes
+        code_dtype = np.int16 if len(categories) < np.iinfo(np.int16).max else np.int32
+        np.save(os.path.join(tmp_dir, f"{name}.npy"), codes.astype(code_dtype))
+        np.save(os.path.join(tmp_dir, f"{name}.categories.npy"), categories)
+        columns.append({"name": name, "kind": "category"})
+
+    meta = {
+        "cache_version": CACHE_VERSION,
+        "source": {
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "sha256": sha256,
+        },
+        "n_rows": len(df),
+        "duplicates_removed": n_rows_raw - len(df),
+        "columns": columns,
+    }
+    _write_meta(tmp_dir, meta)
+
+    publish_dir(tmp_dir, cache_dir)
+    return meta
+
+
+def read_cache(cache_dir, meta, columns=None):
+    """Lê as colunas pedidas do cache colunar"""
+    data = {}
+    for column in meta["columns"]:
+        name = column["name"]
+        if columns is not None and name not in columns:
+            continue
+        values = np.load(os.path.join(cache_dir, f"{name}.npy"))
+        if column["kind"] == "category":
+            categories = np.load(os.path.join(cache_dir, f"{name}.categories.npy"))
+            values = pd.Categorical.from_codes(values, categories=categories)
+        data[name] = values
+    return pd.DataFrame(data)
+
+
+def source_sha256(csv_path):
+    """Hash do CSV registrado no cache, ou None se não houver cache"""
+    meta = _read_meta(cache_dir_for(csv_path))
+    return meta["source"]["sha256"] if meta is not None else None
+
+
+def load_dataset(csv_path, columns=None, encoding="latin1"):
+    """Carrega o dataset sem duplicatas, usando o cache colunar quando válido
+
+    Retorna o DataFrame e o número de linhas duplicadas removidas. Com
+    `columns`, apenas essas colunas são lidas do cache.
+    """
+    if not os.path.exists(csv_path):
+        raise FileNotFoundError(csv_path)
+
+    cache_dir = cache_dir_for(csv_path)
+    meta = _read_meta(cache_dir)
+    if not _is_valid(meta, csv_path, cache_dir):
+        try:
+            build_cache(csv_path, cache_dir, encoding=encoding)
+        except OSError as e:
+            print(f"Não foi possível gravar o cache ({e}), lendo o CSV.")
+            df = pd.read_csv(csv_path, encoding=encoding)
+            n_rows_raw = len(df)
+            df = df.drop_duplicates()
+            if columns is not None:
+                df = df[columns]
+            return df, n_rows_raw - len(df)
+        meta = _read_meta(cache_dir)
+
+    df = read_cache(cache_dir, meta, columns)
+    return df, meta["duplicates_removed"]
@@ -0,0 +1,56 @@
+import hashlib
+import json
+import os
+import tempfile
+import numpy as np
+import pandas as pd
+from storage import publish_dir
+
+FEATURE_STORE_PATH = "feature_store"
+
+
+def feature_key(dataset_fingerprint, pipeline_version):
+    """Chave da matriz codificada: conteúdo do dataset + versão do pipeline"""
+    payload = f"{dataset_fingerprint}:{pipeline_version}"
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:32]
+
+
+def save_features(key, X, y, classes, store_dir=None):
+    """Grava X, y e as classes dos encoders ajustados ({coluna: classes})"""
+    store_dir = store_dir or FEATURE_STORE_PATH
+    os.makedirs(store_dir, exist_ok=True)
+    target = os.path.join(store_dir, key)
+    tmp_dir = tempfile.mkdtemp(prefix=".features-", dir=store_dir)
+
+    np.save(os.path.join(tmp_dir, "X.npy"), X.to_numpy(dtype=np.float64))
+    np.save(os.path.join(tmp_dir, "y.npy"), y.to_numpy(dtype=np.float64))
+    for name, values in classes.items():
+        np.save(os.path.join(tmp_dir, f"{name}_classes.npy"), np.asarray(values, str))
+    meta = {
+        "columns": list(X.columns),
+        "target": y.name,
+        "n_rows": len(y),
+        "classes": sorted(classes),
+    }
+    with open(os.path.join(tmp_dir, "meta.json"), "w") as f:
+        json.dump(meta, f)
+
+    publish_dir(tmp_dir, target)
+
+
+def load_features(key, store_dir=None):
+    """Carrega X, y e o dicionário de classes, ou None se a chave não existir"""
+    target = os.path.join(store_dir or FEATURE_STORE_PATH, key)
+    meta_path = os.path.join(target, "meta.json")
+    if not os.path.exists(meta_path):
+        return None
+    with open(meta_path) as f:
+        meta = json.load(f)
+
+    X = pd.DataFrame(np.load(os.path.join(target, "X.npy")), columns=meta["columns"])
+    y = pd.Series(np.load(os.path.join(target, "y.npy")), name=meta["target"])
+    classes = {
+        name: np.load(os.path.join(target, f"{name}_classes.npy"))
+        for name in meta["classes"]
+    }
+    return X, y, classes
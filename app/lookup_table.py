@@ -0,0 +1,90 @@
+import hashlib
+import json
+import os
+import numpy as np
+
+
+def hash_car_key(key):
+    """Gera um hash estável de 64 bits para a chave normalizada de um veículo
+
+    O `hash` do Python muda entre processos para strings, então a tabela usa
+    blake2b para que o arquivo salvo continue válido em qualquer processo.
+    """
+    text = "|".join(str(value) for value in key)
+    digest = hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "little")
+
+
+class PriceLookupTable:
+    """Tabela de preços pré-calculados indexada pelo hash da chave do veículo
+
+    Os hashes ficam em um array ordenado e a busca é feita com
+    `np.searchsorted`, o que permite abrir os arrays com mmap sem carregar a
+    tabela inteira na memória. `model_fingerprint` identifica o modelo que
+    calculou os preços.
+    """
+
+    def __init__(self, keys, prices, build_seconds=None, model_fingerprint=None):
+        self.keys = keys
+        self.prices = prices
+        self.build_seconds = build_seconds
+        self.model_fingerprint = model_fingerprint
+
+    @classmethod
+    def from_car_keys(
+        cls, car_keys, prices, build_seconds=None, model_fingerprint=None
+    ):
+        """Monta a tabela a partir de chaves normalizadas e preços"""
+        keys = np.fromiter(
+            (hash_car_key(key) for key in car_keys),
+            dtype=np.uint64,
+            count=len(prices),
+        )
+        keys, first = np.unique(keys, return_index=True)
+        prices = np.asarray(prices, dtype=np.float64)[first]
+        return cls(keys, prices, build_seconds, model_fingerprint)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def get(self, key):
+        """Retorna o preço da chave normalizada ou None se não estiver na tabela"""
+        if len(self.keys) == 0:
+            return None
+        key_hash = np.uint64(hash_car_key(key))
+        pos = int(np.searchsorted(self.keys, key_hash))
+        if pos < len(self.keys) and self.keys[pos] == key_hash:
+            return float(self.prices[pos])
+        return None
+
+    def info(self):
+        """Retorna o número de entradas, o tamanho em bytes e o tempo de montagem"""
+        return {
+            "entries": len(self),
+            "bytes": int(self.keys.nbytes + self.prices.nbytes),
+            "build_seconds": self.build_seconds,
+        }
+
+    def save(self, dirpath):
+        """Salva a tabela em um diretório com arrays .npy"""
+        os.makedirs(dirpath, exist_ok=True)
+        np.save(os.path.join(dirpath, "keys.npy"), self.keys)
+        np.save(os.path.join(dirpath, "prices.npy"), self.prices)
+        with open(os.path.join(dirpath, "meta.json"), "w") as f:
+            json.dump({**self.info(), "model_fingerprint": self.model_fingerprint}, f)
+
+    @classmethod
+    def load(cls, dirpath, mmap_mode="r"):
+        """Carrega uma tabela salva, por padrão mapeada em memória"""
+        if not os.path.exists(os.path.join(dirpath, "keys.npy")):
+            return None
+        keys = np.load(os.path.join(dirpath, "keys.npy"), mmap_mode=mmap_mode)
+        prices = np.load(os.path.join(dirpath, "prices.npy"), mmap_mode=mmap_mode)
+        meta = {}
+        meta_path = os.path.join(dirpath, "meta.json")
+        if os.path.exists(meta_path):
+            with open(meta_path) as f:
+                meta = json.load(f)
+        return cls(
+            keys, prices, meta.get("build_seconds"), meta.get("model_fingerprint")
+        )
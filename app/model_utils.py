@@ -1,47 +1,801 @@
+import argparse
+import numpy as np
 import pandas as pd
 import pickle
+import hashlib
+import json
 import os
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from collections import OrderedDict
+from contextlib import contextmanager
 from sklearn.model_selection import train_test_split
 from sklearn.tree import DecisionTreeRegressor
-from sklearn.ensemble import RandomForestRegressor
+from sklearn.ensemble import (
+    ExtraTreesRegressor,
+    HistGradientBoostingRegressor,
+    RandomForestRegressor,
+)
+from sklearn.metrics import mean_absolute_error, r2_score
+from sklearn.linear_model import SGDRegressor
 from sklearn.preprocessing import LabelEncoder, MinMaxScaler
 import warnings
+from tree_engine import CompiledTree
+from lookup_table import PriceLookupTable
+from dataset_cache import load_dataset, source_sha256
+from feature_store import feature_key, load_features, save_features
+from streaming import (
+    DEFAULT_CHUNKSIZE,
+    TARGET_ENCODED_COLUMNS,
+    ScaledTargetRegressor,
+    holdout_mask,
+    iter_chunks,
+    scan_csv,
+    target_means,
+)
 
 warnings.filterwarnings("ignore")
 
+# Colunas de entrada esperadas para cada veículo
+INPUT_COLUMNS = [
+    "year_of_reference",
+    "brand",
+    "model",
+    "fuel",
+    "gear",
+    "engine_size",
+    "year_model",
+]
+NUMERIC_INPUT_COLUMNS = ["year_of_reference", "engine_size", "year_model"]
+ONEHOT_COLUMNS = ["fuel", "gear"]
+TARGET_COLUMN = "avg_price_brl"
+
+# Colunas que o layout "categorical" entrega como categorias nativas ao
+# boosting. `model` passa do limite de 255 categorias do
+# HistGradientBoostingRegressor e vira o ranking da média do preço por modelo.
+NATIVE_CATEGORICAL_COLUMNS = ["brand", "fuel", "gear"]
+
+# Tipos reduzidos usados no modo compacto do dataset
+COMPACT_DTYPES = {
+    "year_of_reference": np.int16,
+    "year_model": np.int16,
+    "engine_size": np.float32,
+    TARGET_COLUMN: np.float32,
+}
+
+# Anos de referência oferecidos na aplicação
+REFERENCE_YEARS = [2020, 2021, 2022, 2023, 2024]
+
+MODEL_PATH = "car_price_model"
+LEGACY_MODEL_PATH = "car_price_model.pkl"
+LOOKUP_TABLE_PATH = "car_price_lookup"
+
+# Pontos fixos do espaço de features usados na impressão digital do modelo
+FINGERPRINT_ROWS = 256
+FINGERPRINT_SEED = 20240101
+
+# Incrementar sempre que a codificação de build_features mudar
+PIPELINE_VERSION = 2
+
+# Versão do formato em diretório gravado por save_model
+ARTIFACT_SCHEMA_VERSION = 4
+ARTIFACT_HEADER = "header.json"
+TREE_ARRAYS = ["feature", "threshold", "left", "right", "value"]
+
+
+class PredictionCache:
+    """Cache LRU limitado para preços previstos, seguro entre threads"""
+
+    def __init__(self, max_size=1024):
+        self.max_size = max_size
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """Retorna o preço em cache ou None, atualizando a ordem LRU"""
+        with self._lock:
+            try:
+                price = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return price
+
+    def put(self, key, price):
+        """Armazena um preço, descartando o item menos usado se necessário"""
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._data[key] = price
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        """Invalida todas as entradas e zera os contadores"""
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+
+    def info(self):
+        """Retorna tamanho atual e contadores de acertos, falhas e descartes"""
+        with self._lock:
+            return {
+                "size": len(self._data),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+def normalize_car_key(
+    year_of_reference, brand, model, fuel, gear, engine_size, year_model
+):
+    """Normaliza os dados de um veículo em uma tupla usada como chave de cache
+
+    A chave só junta entradas que o modelo trata de forma idêntica (2018 e
+    2018.0, por exemplo). Anos fracionários e textos que não são str levantam
+    ValueError/TypeError e a predição segue sem cache.
+    """
+    years = []
+    for year in (year_of_reference, year_model):
+        value = float(year)
+        if not value.is_integer():
+            raise ValueError(f"Ano não inteiro: {year!r}")
+        years.append(int(value))
+    if not all(isinstance(text, str) for text in (brand, model, fuel, gear)):
+        raise TypeError("Marca, modelo, combustível e câmbio devem ser texto")
+    return (years[0], brand, model, fuel, gear, float(engine_size), years[1])
+
+
+def compact_dataframe(df):
+    """Converte textos em categorias e reduz os tipos numéricos conhecidos"""
+    df = df.copy()
+    for col in df.columns:
+        if col in COMPACT_DTYPES:
+            dtype = COMPACT_DTYPES[col]
+            # Colunas inteiras com nulos não cabem em int16
+            if np.issubdtype(dtype, np.integer) and df[col].isna().any():
+                continue
+            df[col] = df[col].astype(dtype)
+        elif not pd.api.types.is_numeric_dtype(df[col]):
+            df[col] = df[col].astype("category")
+    return df
+
+
+def scaler_from_range(data_min, data_max, feature_names):
+    """Reconstrói um MinMaxScaler a partir dos limites de cada feature"""
+    scaler = MinMaxScaler(feature_range=(0, 1))
+    scaler.partial_fit(np.vstack([data_min, data_max]))
+    scaler.feature_names_in_ = np.asarray(feature_names, dtype=object)
+    return scaler
+
+
+@contextmanager
+def track_peak_memory():
+    """Mede o pico de memória do bloco com tracemalloc
+
+    Retorna um dicionário preenchido com `peak_bytes` ao sair do bloco, mesmo
+    com exceção. O rastreamento só é desligado se foi ligado aqui.
+    """
+    already_tracing = tracemalloc.is_tracing()
+    if already_tracing:
+        tracemalloc.reset_peak()
+    else:
+        tracemalloc.start()
+    usage = {}
+    try:
+        yield usage
+    finally:
+        usage["peak_bytes"] = tracemalloc.get_traced_memory()[1]
+        if not already_tracing:
+            tracemalloc.stop()
+
+
+def scalar_params(estimator):
+    """Parâmetros do estimador que podem ir para o JSON de training_info"""
+    return {
+        key: value
+        for key, value in estimator.get_params().items()
+        if isinstance(value, (int, float, str, bool, type(None)))
+    }
+
+
+def lookup_codes(table, values, default, dtype=np.int64):
+    """Busca o código de cada valor em `table`, com `default` se não houver
+
+    Valores não hasheáveis (listas e objetos vindos de JSON) contam como
+    desconhecidos em vez de interromper o lote inteiro.
+    """
+
+    def get(value):
+        try:
+            return table.get(value, default)
+        except TypeError:
+            return default
+
+    count = len(values)
+    try:
+        return np.fromiter((table.get(v, default) for v in values), dtype, count)
+    except TypeError:
+        return np.fromiter(map(get, values), dtype, count)
+
+
+# Estimadores disponíveis para train_model. Cada fábrica recebe n_jobs e os
+# parâmetros extras; o boosting por histograma já usa todos os núcleos via OpenMP.
+ESTIMATORS = {
+    "tree": lambda n_jobs, **params: DecisionTreeRegressor(
+        **{"random_state": 42, **params}
+    ),
+    "random_forest": lambda n_jobs, **params: RandomForestRegressor(
+        **{
+            "random_state": 42,
+            "max_features": "sqrt",
+            "n_estimators": 30,
+            "n_jobs": n_jobs,
+            **params,
+        }
+    ),
+    "extra_trees": lambda n_jobs, **params: ExtraTreesRegressor(
+        **{
+            "random_state": 42,
+            "max_features": "sqrt",
+            "n_estimators": 30,
+            "n_jobs": n_jobs,
+            **params,
+        }
+    ),
+    "hist_gradient_boosting": lambda n_jobs, **params: HistGradientBoostingRegressor(
+        **{"random_state": 42, "max_iter": 300, **params}
+    ),
+    "hist_gradient_boosting_categorical": lambda n_jobs, **params: (
+        HistGradientBoostingRegressor(**{"random_state": 42, "max_iter": 300, **params})
+    ),
+}
+
+# Layout de features de cada estimador; os ausentes usam "onehot"
+# (One-Hot para combustível/câmbio e LabelEncoder para marca/modelo). O treino
+# em streaming usa "target": marca/modelo valem a média do preço no treino
+ESTIMATOR_LAYOUTS = {"hist_gradient_boosting_categorical": "categorical"}
+
 
 class CarPriceModel:
-    def __init__(self):
+    def __init__(self, cache_size=1024):
         self.df = None
+        self.dataset_source = None
         self.model = None
+        # Classe do estimador treinado; `model` pode ser None depois da poda
+        # ou da carga de uma árvore em arrays
+        self.estimator_name = None
+        self.compiled_tree = None
         self.le_brand = None
         self.le_model = None
+        self.feature_layout = "onehot"
+        self.category_classes = {}
+        self.model_rank = None
+        self.target_means = None
+        # Configuração do feature store do último train_model (usada na poda)
+        self.use_feature_store = True
         self.X_columns = None
+        self.encoding = None
+        self.training_info = None
+        self._catalog = None
+        self._unique_values = {}
+        self._models_by_brand = {}
+        self._model_counts = {}
         self.model_trained = False
         self.scaler = MinMaxScaler(feature_range=(0, 1))
+        self.prediction_cache = PredictionCache(cache_size)
+        self.lookup_table = None
 
-    def load_and_preprocess_data(self, csv_path="app/dataset/fipe_cars.csv"):
-        """Carrega e preprocessa os dados"""
-        try:
-            self.df = pd.read_csv(csv_path, encoding="latin1")
-            print(f"Dataset carregado com {len(self.df)} registros")
-        except FileNotFoundError:
+    def load_and_preprocess_data(
+        self,
+        csv_path="app/dataset/fipe_cars.csv",
+        use_cache=True,
+        columns=None,
+        compact=False,
+    ):
+        """Carrega e preprocessa os dados
+
+        Com `use_cache`, o CSV é convertido uma única vez para um cache colunar
+        binário (invalidado quando o arquivo muda) e as cargas seguintes leem
+        apenas as `columns` pedidas desse cache.
+
+        Com `compact`, são lidas só as colunas de entrada e o preço, textos
+        viram categorias, anos viram int16 e motor/preço viram float32. É o
+        modo indicado para manter o DataFrame residente na aplicação; o preço
+        em float32 altera levemente o treino.
+        """
+        if compact and columns is None:
+            columns = INPUT_COLUMNS + [TARGET_COLUMN]
+
+        if use_cache:
+            try:
+                self.df, num_duplicates = load_dataset(csv_path, columns=columns)
+            except FileNotFoundError:
+                print(f"Arquivo '{csv_path}' não encontrado.")
+                return False
+            print(f"Dataset carregado com {len(self.df) + num_duplicates} registros")
+            if num_duplicates > 0:
+                print(f"Removidas {num_duplicates} linhas duplicadas.")
+            self.dataset_source = {
+                "sha256": source_sha256(csv_path),
+                "columns": columns,
+                "compact": compact,
+            }
+        else:
+            self.dataset_source = None
+            try:
+                self.df = pd.read_csv(csv_path, encoding="latin1")
+                print(f"Dataset carregado com {len(self.df)} registros")
+            except FileNotFoundError:
+                print(f"Arquivo '{csv_path}' não encontrado.")
+                return False
+
+            # Remover duplicatas
+            num_duplicates = self.df.duplicated().sum()
+            if num_duplicates > 0:
+                self.df.drop_duplicates(inplace=True)
+                print(f"Removidas {num_duplicates} linhas duplicadas.")
+
+            if columns is not None:
+                self.df = self.df[columns]
+
+        if compact:
+            self.df = compact_dataframe(self.df)
+
+        return True
+
+    def train_model(
+        self,
+        estimator="tree",
+        estimator_params=None,
+        n_jobs=-1,
+        use_feature_store=True,
+    ):
+        """Treina o modelo de previsão
+
+        `estimator` é o nome de um dos ESTIMATORS (tree, random_forest,
+        extra_trees, hist_gradient_boosting, hist_gradient_boosting_categorical)
+        ou um estimador do sklearn já instanciado. Tempo de treino, pico de
+        memória e scores ficam em `training_info` e são salvos junto com o
+        modelo.
+        """
+        if isinstance(estimator, str) and estimator not in ESTIMATORS:
+            print(f"Estimador '{estimator}' desconhecido: {sorted(ESTIMATORS)}")
+            return False
+        if self.df is None:
+            return False
+
+        if isinstance(estimator, str):
+            self.feature_layout = ESTIMATOR_LAYOUTS.get(estimator, "onehot")
+        else:
+            self.feature_layout = "onehot"
+        self.target_means = None
+        self.use_feature_store = use_feature_store
+        X, y = self.build_features(use_feature_store)
+
+        # Dividir dados
+        X_train, X_test, y_train, y_test = train_test_split(
+            X, y, test_size=0.2, random_state=42
+        )
+        estimator_params = dict(estimator_params or {})
+        if self.feature_layout == "categorical":
+            # O ranking de modelos usa só o treino para não vazar o teste
+            X_train, X_test = self._apply_model_rank(X_train, X_test, y_train)
+            # Códigos de categoria não podem ser escalonados: scaler identidade
+            n_features = len(self.X_columns)
+            self.scaler = scaler_from_range(
+                np.zeros(n_features), np.ones(n_features), self.X_columns
+            )
+            X_train = X_train.to_numpy(dtype=np.float64)
+            X_test = X_test.to_numpy(dtype=np.float64)
+            estimator_params.setdefault(
+                "categorical_features",
+                [
+                    self.X_columns.get_loc(f"{col}_encoded")
+                    for col in NATIVE_CATEGORICAL_COLUMNS
+                ],
+            )
+        else:
+            # --- Escalonamento ---
+            self.scaler = MinMaxScaler(feature_range=(0, 1))
+            self.scaler.fit(X_train)  # ajuste apenas no treino
+            X_train_scaled = self.scaler.transform(X_train)
+            X_test_scaled = self.scaler.transform(X_test)
+            X_train, X_test = X_train_scaled, X_test_scaled
+            self.model_rank = None
+        # Treinar modelo
+        if isinstance(estimator, str):
+            estimator_name = estimator
+            self.model = ESTIMATORS[estimator](n_jobs, **estimator_params)
+        else:
+            estimator_name = type(estimator).__name__
+            self.model = estimator
+        self.estimator_name = type(self.model).__name__
+
+        with self._training_run(estimator_name) as info:
+            start = time.perf_counter()
+            self.model.fit(X_train, y_train)
+            fit_seconds = time.perf_counter() - start
+
+            # Na predição de uma linha o paralelismo só adiciona overhead
+            if "n_jobs" in self.model.get_params():
+                self.model.set_params(n_jobs=None)
+
+            # Avaliar modelo
+            info.update(
+                {
+                    "params": scalar_params(self.model),
+                    "n_jobs": n_jobs,
+                    "fit_seconds": fit_seconds,
+                    "train_score": float(self.model.score(X_train, y_train)),
+                    "test_score": float(self.model.score(X_test, y_test)),
+                    "test_mae": float(
+                        mean_absolute_error(y_test, self.model.predict(X_test))
+                    ),
+                    "n_train": len(y_train),
+                    "n_test": len(y_test),
+                }
+            )
+
+        self.encoding = self.build_encoding_tables()
+        self.catalog = self.build_catalog()
+        self.compile_model()
+        self.prediction_cache.clear()
+        self.lookup_table = None
+        self.model_trained = True
+        return True
+
+    @contextmanager
+    def _training_run(self, estimator_name):
+        """Mede o pico de memória de um treino e registra `training_info`
+
+        O bloco preenche o dicionário recebido com parâmetros, tempos, scores
+        e contagens. Se o bloco levantar uma exceção ou sair antes de
+        preencher os scores, nada é registrado; o tracemalloc é desligado de
+        qualquer forma.
+        """
+        info = {"estimator": estimator_name, "feature_layout": self.feature_layout}
+        # O pico de memória cobre as alocações rastreadas pelo Python/NumPy
+        with track_peak_memory() as memory:
+            yield info
+        if "test_score" not in info:
+            return
+        info["peak_memory_mb"] = memory["peak_bytes"] / 1e6
+
+        print(f"Score treino: {info['train_score']:.4f}")
+        print(f"Score teste: {info['test_score']:.4f}")
+        print(f"MAE teste: R$ {info['test_mae']:,.2f}")
+        print(f"Tempo de treino: {info['fit_seconds']:.1f}s")
+        self.training_info = info
+
+    def train_model_streaming(
+        self,
+        csv_path="app/dataset/fipe_cars.csv",
+        chunksize=DEFAULT_CHUNKSIZE,
+        epochs=3,
+        holdout_fraction=0.2,
+        estimator_params=None,
+    ):
+        """Treina lendo o CSV em blocos, sem carregá-lo inteiro na memória
+
+        A primeira passada ajusta os encoders, os limites do scaler e o
+        catálogo, e troca marca e modelo pela média suavizada do preço de cada
+        um nas linhas de treino (layout "target"); as `epochs` passadas
+        seguintes treinam um SGDRegressor com `partial_fit` e uma última
+        passada calcula os scores. A divisão treino/teste é feita pelo hash de
+        cada linha e as duplicatas só são removidas dentro de cada bloco. O
+        pico de memória depende de `chunksize`, não do tamanho do arquivo.
+        """
+        if not os.path.exists(csv_path):
             print(f"Arquivo '{csv_path}' não encontrado.")
             return False
+        self.feature_layout = "target"
+        self.category_classes = {}
+        self.model_rank = None
 
-        # Remover duplicatas
-        num_duplicates = self.df.duplicated().sum()
-        if num_duplicates > 0:
-            self.df.drop_duplicates(inplace=True)
-            print(f"Removidas {num_duplicates} linhas duplicadas.")
+        with self._training_run("sgd_streaming") as info:
+            if not self._fit_streaming(
+                info, csv_path, chunksize, epochs, holdout_fraction, estimator_params
+            ):
+                return False
 
+        # O dataset não fica em memória neste modo
+        self.df = None
+        self.dataset_source = None
+        self.compile_model()
+        self.prediction_cache.clear()
+        self.lookup_table = None
+        self.model_trained = True
         return True
 
-    def train_model(self):
-        """Treina o modelo de previsão"""
-        if self.df is None:
+    def _fit_streaming(
+        self, info, csv_path, chunksize, epochs, holdout_fraction, estimator_params
+    ):
+        """Passadas de train_model_streaming; preenche `info` com os scores"""
+        start = time.perf_counter()
+        stats = scan_csv(
+            csv_path,
+            INPUT_COLUMNS + [TARGET_COLUMN],
+            TARGET_COLUMN,
+            holdout_fraction,
+            chunksize,
+        )
+        if stats["n_train"] == 0:
+            print("Nenhuma linha de treino no arquivo.")
             return False
+        self._fit_encoders_from_stats(stats)
+        scan_seconds = time.perf_counter() - start
+
+        y_mean = stats["y_sum"] / stats["n_train"]
+        y_var = stats["y_sum_sq"] / stats["n_train"] - y_mean**2
+        self.model = ScaledTargetRegressor(
+            SGDRegressor(**{"random_state": 42, **(estimator_params or {})}),
+            y_mean=y_mean,
+            y_scale=float(np.sqrt(y_var)) if y_var > 0 else 1.0,
+        )
+        self.estimator_name = type(self.model).__name__
+
+        start = time.perf_counter()
+        rng = np.random.RandomState(42)
+        for _ in range(epochs):
+            for X, y, is_test in self._iter_encoded_chunks(
+                csv_path, chunksize, holdout_fraction
+            ):
+                # O CSV costuma estar ordenado por data; embaralhar cada bloco
+                train_rows = np.flatnonzero(~is_test)
+                rng.shuffle(train_rows)
+                if train_rows.size:
+                    self.model.partial_fit(X[train_rows], y[train_rows])
+        fit_seconds = time.perf_counter() - start
+
+        # Soma de |erro|, erro², y, y² e contagem para treino (0) e teste (1)
+        totals = np.zeros((2, 5))
+        for X, y, is_test in self._iter_encoded_chunks(
+            csv_path, chunksize, holdout_fraction
+        ):
+            error = self.model.predict(X) - y
+            for split, mask in enumerate((~is_test, is_test)):
+                totals[split] += [
+                    np.abs(error[mask]).sum(),
+                    (error[mask] ** 2).sum(),
+                    y[mask].sum(),
+                    (y[mask] ** 2).sum(),
+                    mask.sum(),
+                ]
+
+        def r2(abs_err, sq_err, y_sum, y_sum_sq, n):
+            total = y_sum_sq - y_sum**2 / n if n else 0.0
+            return 1 - sq_err / total if total > 0 else 0.0
+
+        info.update(
+            {
+                "params": scalar_params(self.model.estimator),
+                "n_jobs": None,
+                "chunksize": chunksize,
+                "epochs": epochs,
+                "scan_seconds": scan_seconds,
+                "fit_seconds": fit_seconds,
+                "train_score": float(r2(*totals[0])),
+                "test_score": float(r2(*totals[1])),
+                "test_mae": (
+                    float(totals[1, 0] / totals[1, 4]) if totals[1, 4] else float("nan")
+                ),
+                "n_train": int(totals[0, 4]),
+                "n_test": int(totals[1, 4]),
+            }
+        )
+        return True
+
+    def _fit_encoders_from_stats(self, stats):
+        """Ajusta encoders, scaler e catálogo com os agregados de scan_csv
+
+        Reproduz as colunas e a escala que `_encode_dataset` + MinMaxScaler
+        produziriam com o dataset inteiro em memória, com marca e modelo
+        valendo a média suavizada do preço no treino em vez do código.
+        """
+        counts = stats["counts"]
+        self.le_brand = LabelEncoder()
+        self.le_brand.classes_ = np.array(sorted(counts["brand"]), dtype=object)
+        self.le_model = LabelEncoder()
+        self.le_model.classes_ = np.array(sorted(counts["model"]), dtype=object)
+        prior = stats["y_sum"] / stats["n_train"]
+        self.target_means = {
+            col: target_means(
+                stats["target_sums"][col],
+                stats["target_counts"][col],
+                encoder.classes_,
+                prior,
+            )
+            for col, encoder in zip(
+                TARGET_ENCODED_COLUMNS, (self.le_brand, self.le_model)
+            )
+        }
 
+        numeric = [col for col in stats["columns"] if col in NUMERIC_INPUT_COLUMNS]
+        onehot = [
+            (prefix, value)
+            for prefix in ONEHOT_COLUMNS
+            for value in sorted(counts[prefix])
+        ]
+        self.X_columns = pd.Index(
+            numeric
+            + [f"{prefix}_{value}" for prefix, value in onehot]
+            + ["brand_encoded", "model_encoded"]
+        )
+
+        # Uma coluna One-Hot só tem mínimo 1 se o valor aparece em todas as linhas
+        data_min = (
+            [stats["min"][col] for col in numeric]
+            + [float(counts[p][v] == stats["n_rows"]) for p, v in onehot]
+            + [self.target_means[col].min() for col in TARGET_ENCODED_COLUMNS]
+        )
+        data_max = (
+            [stats["max"][col] for col in numeric]
+            + [1.0] * len(onehot)
+            + [self.target_means[col].max() for col in TARGET_ENCODED_COLUMNS]
+        )
+        self.scaler = scaler_from_range(
+            np.array(data_min, dtype=np.float64),
+            np.array(data_max, dtype=np.float64),
+            self.X_columns,
+        )
+        self.encoding = self.build_encoding_tables()
+
+        self.catalog = {
+            "brands": sorted(str(b) for b in counts["brand"]),
+            "fuels": sorted(str(f) for f in counts["fuel"]),
+            "gears": sorted(str(g) for g in counts["gear"]),
+            "year_range": (
+                int(stats["min"]["year_model"]),
+                int(stats["max"]["year_model"]),
+            ),
+            "engine_range": (
+                round(float(stats["min"]["engine_size"]), 6),
+                round(float(stats["max"]["engine_size"]), 6),
+            ),
+            "models_by_brand": {
+                str(brand): sorted(str(m) for m in models)
+                for brand, models in sorted(stats["models_by_brand"].items())
+            },
+        }
+
+    def _iter_encoded_chunks(self, csv_path, chunksize, holdout_fraction):
+        """Gera (X escalonado, y, máscara de teste) para cada bloco do CSV"""
+        for chunk in iter_chunks(csv_path, INPUT_COLUMNS + [TARGET_COLUMN], chunksize):
+            is_test = holdout_mask(chunk, holdout_fraction)
+            X, valid, _ = self.encode_features(
+                {col: chunk[col].to_numpy() for col in INPUT_COLUMNS}
+            )
+            y = chunk[TARGET_COLUMN].to_numpy(dtype=np.float64)
+            yield X[valid], y[valid], is_test[valid]
+
+    def dataset_fingerprint(self):
+        """Identifica o conteúdo do dataset carregado
+
+        Se o dataset veio do cache colunar, usa o hash do CSV (com as colunas
+        e o modo pedidos); senão, calcula o hash do próprio DataFrame.
+        """
+        digest = hashlib.sha256()
+        if self.dataset_source is not None and self.dataset_source["sha256"]:
+            digest.update(json.dumps(self.dataset_source, sort_keys=True).encode())
+        else:
+            digest.update(str(list(self.df.dtypes.items())).encode())
+            digest.update(
+                pd.util.hash_pandas_object(self.df, index=False).to_numpy().tobytes()
+            )
+        return digest.hexdigest()
+
+    def build_features(self, use_feature_store=True, store_dir=None):
+        """Codifica o dataset na matriz de features e no alvo
+
+        Ajusta os LabelEncoders de marca e modelo e guarda as colunas de
+        features em `X_columns`, no layout de `feature_layout`. Com
+        `use_feature_store`, a matriz e os encoders ficam salvos em disco,
+        indexados pelo dataset, pelo layout e pela versão do pipeline, e as
+        execuções seguintes apenas os carregam.
+        """
+        key = None
+        if use_feature_store:
+            key = feature_key(
+                self.dataset_fingerprint(),
+                f"{PIPELINE_VERSION}-{self.feature_layout}",
+            )
+            stored = load_features(key, store_dir)
+            if stored is not None:
+                X, y, classes = stored
+                self.le_brand = LabelEncoder()
+                self.le_brand.classes_ = classes.pop("brand")
+                self.le_model = LabelEncoder()
+                self.le_model.classes_ = classes.pop("model")
+                self.category_classes = classes
+                self.X_columns = X.columns
+                return X, y
+
+        if self.feature_layout == "categorical":
+            X, y = self._encode_dataset_categorical()
+        else:
+            X, y = self._encode_dataset()
+            self.category_classes = {}
+        if key is not None:
+            classes = {
+                "brand": self.le_brand.classes_,
+                "model": self.le_model.classes_,
+                **self.category_classes,
+            }
+            save_features(key, X, y, classes, store_dir)
+        return X, y
+
+    def _encode_dataset_categorical(self):
+        """Codifica o dataset com códigos inteiros para o boosting categórico
+
+        Marca, combustível e câmbio viram códigos 0..n-1 (categorias nativas);
+        o modelo recebe o código do LabelEncoder, trocado pelo ranking de
+        preço em `_apply_model_rank` depois da divisão treino/teste.
+        """
+        df = self.df.drop(
+            ["fipe_code", "authentication", "month_of_reference"],
+            axis=1,
+            errors="ignore",
+        ).dropna()
+
+        numeric = [
+            col
+            for col in df.columns
+            if col not in ("brand", "model", *ONEHOT_COLUMNS, TARGET_COLUMN)
+        ]
+        X = df[numeric].copy()
+
+        self.le_brand = LabelEncoder()
+        X["brand_encoded"] = self.le_brand.fit_transform(df["brand"])
+        self.le_model = LabelEncoder()
+        X["model_encoded"] = self.le_model.fit_transform(df["model"])
+
+        self.category_classes = {}
+        for col in ONEHOT_COLUMNS:
+            encoder = LabelEncoder()
+            X[f"{col}_encoded"] = encoder.fit_transform(df[col])
+            self.category_classes[col] = encoder.classes_
+
+        y = df[TARGET_COLUMN]
+        self.X_columns = X.columns
+        return X, y
+
+    def _apply_model_rank(self, X_train, X_test, y_train):
+        """Troca o código de cada modelo pela posição da sua média de preço
+
+        Modelos sem linhas no treino recebem a média geral do treino.
+        """
+        codes = X_train["model_encoded"].to_numpy(dtype=np.intp)
+        n_models = len(self.le_model.classes_)
+        sums = np.bincount(codes, weights=y_train.to_numpy(), minlength=n_models)
+        counts = np.bincount(codes, minlength=n_models)
+        means = np.where(counts > 0, sums / np.maximum(counts, 1), y_train.mean())
+        self.model_rank = np.argsort(np.argsort(means, kind="stable"), kind="stable")
+
+        X_train = X_train.assign(model_encoded=self.model_rank[codes])
+        X_test = X_test.assign(
+            model_encoded=self.model_rank[
+                X_test["model_encoded"].to_numpy(dtype=np.intp)
+            ]
+        )
+        return X_train, X_test
+
+    def _encode_dataset(self):
+        """Aplica a codificação completa ao dataset carregado"""
         # Preprocessamento
         df_processed = self.df.copy()
 
@@ -66,7 +820,9 @@ class CarPriceModel:
 
         # Remover colunas irrelevantes
         df_processed = df_processed.drop(
-            ["fipe_code", "authentication", "month_of_reference"], axis=1
+            ["fipe_code", "authentication", "month_of_reference"],
+            axis=1,
+            errors="ignore",
         )
 
         # Remover valores nulos
@@ -79,65 +835,461 @@ class CarPriceModel:
         # Salvar as colunas para usar na predição
         self.X_columns = X.columns
 
-        # Dividir dados
+        return X, y
+
+    def build_encoding_tables(self):
+        """Monta as tabelas de codificação usadas na predição
+
+        Converte os LabelEncoders, as colunas do One-Hot Encoding e o scaler em
+        dicionários categoria -> código/índice de coluna e arrays de escala,
+        para que a predição preencha o vetor de features diretamente, sem
+        pandas.
+        """
+        columns = list(self.X_columns)
+        column_index = {col: i for i, col in enumerate(columns)}
+
+        brand_codes = {str(c): i for i, c in enumerate(self.le_brand.classes_)}
+        model_codes = {str(c): i for i, c in enumerate(self.le_model.classes_)}
+        if self.feature_layout == "target":
+            brand_codes, model_codes = (
+                {str(c): float(mean) for c, mean in zip(encoder.classes_, means)}
+                for encoder, means in (
+                    (self.le_brand, self.target_means["brand"]),
+                    (self.le_model, self.target_means["model"]),
+                )
+            )
+        onehot_index = {}
+        category_index = {}
+        category_codes = {}
+        if self.feature_layout == "categorical":
+            model_codes = {
+                str(c): int(rank)
+                for c, rank in zip(self.le_model.classes_, self.model_rank)
+            }
+            for col, classes in self.category_classes.items():
+                category_index[col] = column_index[f"{col}_encoded"]
+                category_codes[col] = {str(c): i for i, c in enumerate(classes)}
+        else:
+            for prefix in ONEHOT_COLUMNS:
+                onehot_index[prefix] = {
+                    col[len(prefix) + 1 :]: i
+                    for i, col in enumerate(columns)
+                    if col.startswith(prefix + "_")
+                }
+
+        return {
+            "n_features": len(columns),
+            "numeric_index": {
+                col: column_index[col]
+                for col in NUMERIC_INPUT_COLUMNS
+                if col in column_index
+            },
+            "brand_index": column_index["brand_encoded"],
+            "model_index": column_index["model_encoded"],
+            "brand_codes": brand_codes,
+            "model_codes": model_codes,
+            "onehot_index": onehot_index,
+            "category_index": category_index,
+            "category_codes": category_codes,
+            "scale": np.asarray(self.scaler.scale_, dtype=np.float64),
+            "min": np.asarray(self.scaler.min_, dtype=np.float64),
+        }
+
+    def encode_features(self, car_columns):
+        """Codifica colunas de entrada no vetor de features já escalonado
+
+        Retorna a matriz de features, a máscara de linhas válidas e um array
+        com a mensagem de erro de cada linha (None quando a linha é válida).
+        """
+        enc = self.encoding
+        n_rows = len(car_columns["brand"])
+        X = np.zeros((n_rows, enc["n_features"]), dtype=np.float64)
+        errors = np.full(n_rows, None, dtype=object)
+        valid = np.ones(n_rows, dtype=bool)
+
+        def mark_invalid(mask, message):
+            mask = mask & valid
+            errors[mask] = message
+            valid[mask] = False
+
+        # Colunas numéricas
+        for col in NUMERIC_INPUT_COLUMNS:
+            try:
+                values = np.asarray(car_columns[col], dtype=np.float64)
+            except (TypeError, ValueError):
+                values = pd.to_numeric(
+                    pd.Series(car_columns[col]), errors="coerce"
+                ).to_numpy(dtype=np.float64)
+            mark_invalid(~np.isfinite(values), f"Valor inválido para '{col}'")
+            if col in enc["numeric_index"]:
+                X[:, enc["numeric_index"][col]] = values
+
+        # Label Encoding (ou média do preço, no layout "target") para brand e model
+        for col, message in (
+            ("brand", "Marca desconhecida"),
+            ("model", "Modelo desconhecido"),
+        ):
+            codes_table = enc[f"{col}_codes"]
+            codes = lookup_codes(codes_table, car_columns[col], -1, np.float64)
+            mark_invalid(codes < 0, message)
+            X[:, enc[f"{col}_index"]] = codes
+
+        # One-Hot Encoding para fuel e gear
+        rows = np.arange(n_rows)
+        for prefix, index_table in enc["onehot_index"].items():
+            col_idx = lookup_codes(index_table, car_columns[prefix], -1)
+            known = col_idx >= 0
+            X[rows[known], col_idx[known]] = 1.0
+
+        # Categorias nativas do layout "categorical"; desconhecidas viram NaN,
+        # que o boosting trata como valor ausente
+        for col, codes_table in enc.get("category_codes", {}).items():
+            X[:, enc["category_index"][col]] = lookup_codes(
+                codes_table, car_columns[col], np.nan, np.float64
+            )
+
+        X[~valid] = 0.0
+
+        # Escalonamento (equivalente a MinMaxScaler.transform)
+        X *= enc["scale"]
+        X += enc["min"]
+
+        return X, valid, errors
+
+    def compile_model(self):
+        """Exporta a árvore de decisão para o motor de inferência em arrays
+
+        Estimadores que não são uma única árvore continuam usando o `predict`
+        do sklearn.
+        """
+        if isinstance(self.model, DecisionTreeRegressor):
+            self.compiled_tree = CompiledTree.from_sklearn(self.model)
+        else:
+            self.compiled_tree = None
+
+    def compact_model(self, prune_mae_tolerance=None):
+        """Compacta a árvore treinada para reduzir o artefato e a memória
+
+        Converte a árvore compilada para o formato compacto de CompiledTree,
+        sem alterar as predições. Com `prune_mae_tolerance` (ex.: 0.02 para
+        2%), a árvore é antes podada por custo-complexidade com o maior
+        `ccp_alpha` cujo MAE de validação não passe do MAE da árvore completa
+        vezes (1 + tolerância); isso exige o dataset carregado. Retorna nós,
+        bytes do artefato e bytes da árvore em memória antes e depois.
+        """
+        if self.compiled_tree is None:
+            print("A compactação só se aplica a uma DecisionTreeRegressor.")
+            return None
+
+        before = self._tree_footprint()
+        if prune_mae_tolerance is not None and not self._prune_tree(
+            prune_mae_tolerance
+        ):
+            return None
+        self.compiled_tree = self.compiled_tree.compact()
+        after = self._tree_footprint()
+        if self.training_info is not None:
+            self.training_info["compact"] = True
+
+        print(f"Nós: {before['nodes']:,} -> {after['nodes']:,}")
+        for label, key in (
+            ("Artefato", "artifact_bytes"),
+            ("Árvore em memória", "memory_bytes"),
+        ):
+            print(f"{label}: {before[key] / 1e6:.2f} MB -> {after[key] / 1e6:.2f} MB")
+        return {"before": before, "after": after}
+
+    def _tree_footprint(self):
+        """Nós, tamanho do artefato salvo e bytes da árvore compilada"""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, MODEL_PATH)
+            self.save_model(path)
+            artifact_bytes = sum(entry.stat().st_size for entry in os.scandir(path))
+        return {
+            "nodes": self.compiled_tree.node_count,
+            "artifact_bytes": artifact_bytes,
+            "memory_bytes": self.compiled_tree.nbytes,
+        }
+
+    def _prune_tree(self, mae_tolerance):
+        """Poda por custo-complexidade limitada por uma tolerância de MAE
+
+        O alpha é escolhido em uma validação separada do treino: uma árvore
+        treinada sem a validação é podada com alphas em busca binária (escala
+        log), supondo que o MAE cresce com o alpha. O alpha escolhido poda
+        então a árvore treinada, cujo MAE é medido na divisão de teste de
+        train_model (nunca usada no treino); se passar da tolerância, o alpha
+        é reduzido até respeitá-la. A poda é feita nos arrays compilados, sem
+        retreinar; o estimador do sklearn deixa de corresponder à árvore e é
+        descartado.
+        """
+        if self.df is None or not isinstance(self.model, DecisionTreeRegressor):
+            print("A poda precisa do dataset carregado e da árvore do sklearn.")
+            return False
+
+        X, y = self.build_features(self.use_feature_store)
         X_train, X_test, y_train, y_test = train_test_split(
             X, y, test_size=0.2, random_state=42
         )
-        # --- Escalonamento ---
-        self.scaler.fit(X_train)  # ajuste apenas no treino
-        X_train_scaled = self.scaler.transform(X_train)
-        X_test_scaled = self.scaler.transform(X_test)
-        X_train, X_test = X_train_scaled, X_test_scaled
-        # Treinar modelo
-        self.model = DecisionTreeRegressor(random_state=42)
-        # self.model = RandomForestRegressor(
-        #    random_state=42, max_features="sqrt", n_estimators=30
-        # )
-        self.model.fit(X_train, y_train)
+        X_train = self.scaler.transform(X_train)
+        X_test = self.scaler.transform(X_test)
+        X_fit, X_val, y_fit, y_val = train_test_split(
+            X_train, y_train, test_size=0.2, random_state=42
+        )
 
-        # Avaliar modelo
-        train_score = self.model.score(X_train, y_train)
-        test_score = self.model.score(X_test, y_test)
+        def node_cost(estimator):
+            # Mesma medida de custo usada pelo ccp_alpha do sklearn
+            tree = estimator.tree_
+            weight = tree.weighted_n_node_samples
+            return tree.impurity * weight / weight[0]
 
-        print(f"Score treino: {train_score:.4f}")
-        print(f"Score teste: {test_score:.4f}")
+        val_model = DecisionTreeRegressor(**self.model.get_params())
+        val_model.fit(X_fit, y_fit)
+        val_tree = CompiledTree.from_sklearn(val_model)
+        val_cost = node_cost(val_model)
 
-        self.model_trained = True
+        def val_mae(alpha):
+            return mean_absolute_error(
+                y_val, val_tree.prune(val_cost, alpha).predict(X_val)
+            )
+
+        def largest_alpha(mae, limit, max_alpha):
+            # Busca binária em escala log pelo maior alpha com MAE <= limite
+            low, high = np.log(max_alpha) - 30, np.log(max_alpha)
+            best = 0.0
+            for _ in range(40):
+                mid = (low + high) / 2
+                if mae(np.exp(mid)) <= limit:
+                    best, low = float(np.exp(mid)), mid
+                else:
+                    high = mid
+            return best
+
+        # Com alpha >= custo da raiz a árvore vira uma única folha
+        limit = mean_absolute_error(y_val, val_tree.predict(X_val))
+        ccp_alpha = largest_alpha(val_mae, limit * (1 + mae_tolerance), val_cost[0])
+
+        full_tree = CompiledTree.from_sklearn(self.model)
+        full_cost = node_cost(self.model)
+
+        def test_mae_for(alpha):
+            return mean_absolute_error(
+                y_test, full_tree.prune(full_cost, alpha).predict(X_test)
+            )
+
+        nodes_before = self.compiled_tree.node_count
+        mae_before = mean_absolute_error(y_test, full_tree.predict(X_test))
+        test_limit = mae_before * (1 + mae_tolerance)
+        if ccp_alpha > 0 and test_mae_for(ccp_alpha) > test_limit:
+            print(
+                f"ccp_alpha={ccp_alpha:.4g} passa da tolerância no teste; "
+                "reduzindo o alpha."
+            )
+            ccp_alpha = largest_alpha(test_mae_for, test_limit, ccp_alpha)
+
+        self.compiled_tree = full_tree.prune(full_cost, ccp_alpha)
+        self.model = None
+        test_mae = mean_absolute_error(y_test, self.predict_features(X_test))
+        print(
+            f"Poda (ccp_alpha={ccp_alpha:.4g}): {nodes_before} -> "
+            f"{self.compiled_tree.node_count} nós, MAE teste "
+            f"R$ {mae_before:,.2f} -> R$ {test_mae:,.2f}"
+        )
+
+        if self.training_info is not None:
+            self.training_info.update(
+                {
+                    "ccp_alpha": ccp_alpha,
+                    "train_score": float(
+                        r2_score(y_train, self.predict_features(X_train))
+                    ),
+                    "test_score": float(
+                        r2_score(y_test, self.predict_features(X_test))
+                    ),
+                    "test_mae": float(test_mae),
+                }
+            )
+        # As predições mudaram
+        self.prediction_cache.clear()
+        self.lookup_table = None
         return True
 
-    def get_unique_values(self):
-        """Retorna valores únicos para os campos de entrada"""
+    def predict_features(self, X):
+        """Prevê preços a partir da matriz de features já escalonada"""
+        if self.compiled_tree is not None:
+            return self.compiled_tree.predict(X)
+        return self.model.predict(X)
+
+    def build_catalog(self):
+        """Monta o catálogo de valores de entrada a partir do dataset
+
+        O catálogo é salvo junto com o modelo para que a aplicação não precise
+        ler o CSV para preencher os campos de entrada.
+        """
         if self.df is None:
-            return {}
+            return None
 
+        models_by_brand = self.df.groupby("brand")["model"].unique()
         return {
-            "brands": sorted(self.df["brand"].unique()),
-            "fuels": sorted(self.df["fuel"].unique()),
-            "gears": sorted(self.df["gear"].unique()),
+            "brands": sorted(str(b) for b in self.df["brand"].unique()),
+            "fuels": sorted(str(f) for f in self.df["fuel"].unique()),
+            "gears": sorted(str(g) for g in self.df["gear"].unique()),
             "year_range": (
                 int(self.df["year_model"].min()),
                 int(self.df["year_model"].max()),
             ),
+            # Arredondar remove o ruído de float32 do modo compacto (1.6000000238)
             "engine_range": (
-                float(self.df["engine_size"].min()),
-                float(self.df["engine_size"].max()),
+                round(float(self.df["engine_size"].min()), 6),
+                round(float(self.df["engine_size"].max()), 6),
             ),
+            "models_by_brand": {
+                str(brand): sorted(str(m) for m in models)
+                for brand, models in models_by_brand.items()
+            },
+        }
+
+    @property
+    def catalog(self):
+        return self._catalog
+
+    @catalog.setter
+    def catalog(self, catalog):
+        """Define o catálogo e monta os índices usados nas consultas"""
+        self._catalog = catalog
+        if catalog is None:
+            self._unique_values = {}
+            self._models_by_brand = {}
+            self._model_counts = {}
+            return
+
+        self._unique_values = {
+            "brands": tuple(catalog["brands"]),
+            "fuels": tuple(catalog["fuels"]),
+            "gears": tuple(catalog["gears"]),
+            "year_range": tuple(catalog["year_range"]),
+            "engine_range": tuple(catalog["engine_range"]),
+        }
+        self._models_by_brand = {
+            brand: tuple(models) for brand, models in catalog["models_by_brand"].items()
+        }
+        self._model_counts = {
+            brand: len(models) for brand, models in self._models_by_brand.items()
         }
 
+    def _ensure_catalog(self):
+        """Monta o catálogo a partir do dataset se o artefato não trouxe um"""
+        if self._catalog is None and self.df is not None:
+            self.catalog = self.build_catalog()
+
+    def get_unique_values(self):
+        """Retorna valores únicos para os campos de entrada"""
+        self._ensure_catalog()
+        return self._unique_values
+
     def get_models_by_brand(self, brand):
         """Retorna modelos disponíveis para uma marca específica"""
-        if self.df is None:
-            return []
-        return sorted(self.df[self.df["brand"] == brand]["model"].unique())
+        self._ensure_catalog()
+        return self._models_by_brand.get(brand, ())
+
+    def count_models_by_brand(self, brand):
+        """Retorna quantos modelos existem para uma marca específica"""
+        self._ensure_catalog()
+        return self._model_counts.get(brand, 0)
+
+    def predict_batch(self, cars, return_errors=False):
+        """Faz a predição de preços para vários carros de uma só vez
+
+        `cars` pode ser um DataFrame ou um dicionário de colunas (listas ou
+        arrays) com as colunas de INPUT_COLUMNS. Retorna um array NumPy com os
+        preços previstos, com NaN nas linhas inválidas. Com
+        `return_errors=True` retorna também um array com a mensagem de erro de
+        cada linha (None quando a linha foi prevista com sucesso).
+        """
+        if not self.model_trained:
+            return None
+
+        missing = [col for col in INPUT_COLUMNS if col not in cars]
+        if missing:
+            raise ValueError(f"Colunas ausentes: {missing}")
+        if isinstance(cars, pd.DataFrame):
+            car_columns = {col: cars[col].to_numpy() for col in INPUT_COLUMNS}
+        else:
+            car_columns = {col: cars[col] for col in INPUT_COLUMNS}
+
+        X, valid, errors = self.encode_features(car_columns)
+
+        prices = np.full(len(X), np.nan)
+        if valid.any():
+            prices[valid] = self.predict_features(X[valid])
+
+        return (prices, errors) if return_errors else prices
 
     def predict_price(
+        self,
+        year_of_reference,
+        brand,
+        model,
+        fuel,
+        gear,
+        engine_size,
+        year_model,
+        return_error=False,
+    ):
+        """Faz a predição do preço do carro
+
+        Com `return_error=True` retorna (preço, mensagem de erro) em vez de
+        imprimir o erro; o preço é None quando há erro.
+        """
+        price, error = self._predict_one(
+            year_of_reference, brand, model, fuel, gear, engine_size, year_model
+        )
+        if return_error:
+            return price, error
+        if error is not None:
+            print(f"Erro na predição: {error}")
+        return price
+
+    def lookup_price(
         self, year_of_reference, brand, model, fuel, gear, engine_size, year_model
     ):
-        """Faz a predição do preço do carro"""
+        """Procura o preço no cache e na tabela de preços, sem usar o modelo
+
+        Retorna (chave normalizada, preço). A chave é None quando os valores
+        não podem ser normalizados e o preço é None quando não há preço pronto.
+        """
+        try:
+            key = normalize_car_key(
+                year_of_reference, brand, model, fuel, gear, engine_size, year_model
+            )
+        except (TypeError, ValueError):
+            return None, None
+
+        cached_price = self.prediction_cache.get(key)
+        if cached_price is not None:
+            return key, cached_price
+        if self.lookup_table is not None:
+            table_price = self.lookup_table.get(key)
+            if table_price is not None:
+                self.prediction_cache.put(key, table_price)
+                return key, table_price
+        return key, None
+
+    def _predict_one(
+        self, year_of_reference, brand, model, fuel, gear, engine_size, year_model
+    ):
+        """Prevê um carro usando o cache e a tabela de preços; retorna (preço, erro)"""
         if not self.model_trained:
-            return None
+            return None, "Modelo não treinado"
 
-        # Criar DataFrame com os dados de entrada
+        key, price = self.lookup_price(
+            year_of_reference, brand, model, fuel, gear, engine_size, year_model
+        )
+        if price is not None:
+            return price, None
+
+        # Prever com os valores recebidos, como predict_batch; a chave serve
+        # apenas para o cache. Criar dados de entrada com uma única linha
         car_data = {
             "year_of_reference": [year_of_reference],
             "brand": [brand],
@@ -148,85 +1300,357 @@ class CarPriceModel:
             "year_model": [year_model],
         }
 
-        car_df = pd.DataFrame(car_data)
+        prices, errors = self.predict_batch(car_data, return_errors=True)
+        if errors[0] is not None:
+            return None, errors[0]
 
-        try:
-            # Aplicar transformações
-            car_df["brand_encoded"] = self.le_brand.transform(car_df["brand"])
-            car_df["model_encoded"] = self.le_model.transform(car_df["model"])
+        if key is not None:
+            self.prediction_cache.put(key, prices[0])
+        return prices[0], None
 
-            # One-Hot Encoding
-            car_df = pd.get_dummies(
-                car_df, columns=["fuel", "gear"], prefix=["fuel", "gear"]
-            )
-            car_df = car_df.drop(["brand", "model"], axis=1)
+    def cache_info(self):
+        """Retorna as estatísticas do cache de predições"""
+        return self.prediction_cache.info()
+
+    def build_lookup_table(self, reference_years=REFERENCE_YEARS):
+        """Pré-calcula o preço de todas as combinações vistas no dataset
+
+        Cada combinação distinta de marca, modelo, combustível, câmbio, motor
+        e ano do modelo é cruzada com os anos de referência.
+        """
+        if self.df is None or not self.model_trained:
+            return None
+
+        start = time.perf_counter()
+        combos = self.df[INPUT_COLUMNS[1:]].drop_duplicates()
+        # No modo compacto o motor é float32 (1.1 vira 1.100000023841858);
+        # arredondar como no catálogo para que as chaves batam com as entradas
+        combos["engine_size"] = combos["engine_size"].astype(np.float64).round(6)
+        grid = combos.merge(
+            pd.DataFrame({"year_of_reference": reference_years}), how="cross"
+        )[INPUT_COLUMNS]
+
+        prices = self.predict_batch(grid)
+        valid = ~np.isnan(prices)
+        car_keys = [
+            normalize_car_key(*row) for row in grid[valid].itertuples(index=False)
+        ]
+        build_seconds = time.perf_counter() - start
+        self.lookup_table = PriceLookupTable.from_car_keys(
+            car_keys, prices[valid], build_seconds, self.model_fingerprint()
+        )
 
-            # Alinhar colunas
-            final_car_df = car_df.reindex(columns=self.X_columns, fill_value=0)
+        info = self.lookup_table.info()
+        print(
+            f"Tabela de preços: {info['entries']} combinações, "
+            f"{info['bytes'] / 1e6:.1f} MB, montada em {build_seconds:.1f}s"
+        )
+        return self.lookup_table
 
-            # Fazer predição
-            final_car_scaled = self.scaler.transform(final_car_df)
-            predicted_price = self.model.predict(final_car_scaled)
+    def load_lookup_table(self, dirpath=LOOKUP_TABLE_PATH):
+        """Carrega a tabela de preços pré-calculados, se existir
 
-            return predicted_price[0]
+        Tabelas montadas por outro modelo (ou sem impressão digital) são
+        ignoradas, para não responder com preços do modelo antigo.
+        """
+        self.lookup_table = None
+        table = PriceLookupTable.load(dirpath)
+        if table is None or not self.model_trained:
+            return False
+        if table.model_fingerprint != self.model_fingerprint():
+            print(
+                f"Tabela de preços em '{dirpath}' foi montada por outro modelo "
+                "e será ignorada."
+            )
+            return False
+        self.lookup_table = table
+        return True
+
+    def model_fingerprint(self):
+        """Identifica o modelo pelas colunas, classes e predições
 
-        except ValueError as e:
-            print(f"Erro na predição: {e}")
+        As predições são feitas sobre pontos fixos do espaço de features, então
+        o mesmo modelo tem a mesma impressão digital recém-treinado, no pickle
+        ou no diretório versionado.
+        """
+        if not self.model_trained:
             return None
+        digest = hashlib.sha256()
+        digest.update("|".join(self.X_columns).encode("utf-8"))
+        for classes in (
+            self.le_brand.classes_,
+            self.le_model.classes_,
+            *self.category_classes.values(),
+        ):
+            digest.update(("|".join(str(c) for c in classes) + "\n").encode("utf-8"))
+        for means in (self.target_means or {}).values():
+            digest.update(np.asarray(means, dtype=np.float64).tobytes())
+
+        rng = np.random.default_rng(FINGERPRINT_SEED)
+        probe = rng.random((FINGERPRINT_ROWS, len(self.X_columns)))
+        # Colunas de categoria nativa recebem códigos inteiros válidos
+        for col, index in self.encoding.get("category_index", {}).items():
+            n_classes = len(self.category_classes.get(col, [])) or 1
+            probe[:, index] = rng.integers(0, n_classes, FINGERPRINT_ROWS)
+        prices = np.asarray(self.predict_features(probe), dtype=np.float64)
+        digest.update(prices.tobytes())
+        return digest.hexdigest()
 
-    def save_model(self, filepath="car_price_model.pkl"):
-        """Salva o modelo treinado"""
-        if self.model_trained:
+    def save_model(self, filepath=MODEL_PATH):
+        """Salva o modelo treinado
+
+        Caminhos terminados em .pkl usam o formato antigo (pickle único). Os
+        demais são gravados como um diretório versionado com um cabeçalho JSON
+        e arrays .npy que podem ser abertos com mmap.
+        """
+        if not self.model_trained:
+            return False
+
+        if filepath.endswith(".pkl"):
             model_data = {
                 "model": self.model,
+                "estimator_name": self.estimator_name,
                 "le_brand": self.le_brand,
                 "le_model": self.le_model,
                 "X_columns": self.X_columns,
                 "scaler": self.scaler,
+                "encoding": self.encoding,
+                "feature_layout": self.feature_layout,
+                "category_classes": self.category_classes,
+                "model_rank": self.model_rank,
+                "target_means": self.target_means,
+                "catalog": self.catalog,
+                "training_info": self.training_info,
+                # Depois da compactação ou da poda a árvore compilada é a única
+                # versão fiel do modelo (`model` fica desatualizado ou None)
+                "compiled_tree": (
+                    self.compiled_tree.arrays
+                    if self.compiled_tree is not None
+                    else None
+                ),
             }
             with open(filepath, "wb") as f:
                 pickle.dump(model_data, f)
             return True
-        return False
 
-    def load_model(self, filepath="car_price_model.pkl"):
-        """Carrega um modelo salvo"""
-        if os.path.exists(filepath):
+        os.makedirs(filepath, exist_ok=True)
+        arrays = {
+            "brand_classes": np.asarray(self.le_brand.classes_, dtype=str),
+            "model_classes": np.asarray(self.le_model.classes_, dtype=str),
+            "scaler_data_min": self.scaler.data_min_,
+            "scaler_data_max": self.scaler.data_max_,
+        }
+        if self.model_rank is not None:
+            arrays["model_rank"] = self.model_rank
+        for col, means in (self.target_means or {}).items():
+            arrays[f"{col}_target_mean"] = means
+        if self.compiled_tree is not None:
+            if self.compiled_tree.leaf_values is None:
+                estimator_format = "tree_arrays"
+            else:
+                estimator_format = "compact_tree_arrays"
+            for name, array in self.compiled_tree.arrays.items():
+                arrays[f"tree_{name}"] = array
+        else:
+            estimator_format = "pickle"
+            with open(os.path.join(filepath, "estimator.pkl"), "wb") as f:
+                pickle.dump(self.model, f)
+
+        for name, array in arrays.items():
+            np.save(os.path.join(filepath, f"{name}.npy"), array)
+
+        # O cabeçalho é gravado por último: sua presença indica artefato completo
+        header = {
+            "schema_version": ARTIFACT_SCHEMA_VERSION,
+            "feature_columns": list(self.X_columns),
+            "feature_layout": self.feature_layout,
+            "category_classes": {
+                col: [str(c) for c in classes]
+                for col, classes in self.category_classes.items()
+            },
+            "estimator": self.estimator_name,
+            "estimator_format": estimator_format,
+            "catalog": self.catalog,
+            "training": self.training_info,
+        }
+        with open(os.path.join(filepath, ARTIFACT_HEADER), "w") as f:
+            json.dump(header, f, indent=2)
+        return True
+
+    def load_model(self, filepath=MODEL_PATH):
+        """Carrega um modelo salvo (diretório versionado ou pickle antigo)"""
+        if os.path.isdir(filepath):
+            if not self._load_artifact(filepath):
+                return False
+        elif os.path.exists(filepath):
             with open(filepath, "rb") as f:
                 model_data = pickle.load(f)
 
             self.model = model_data["model"]
+            self.estimator_name = (
+                model_data.get("estimator_name") or type(self.model).__name__
+            )
             self.le_brand = model_data["le_brand"]
             self.le_model = model_data["le_model"]
             self.X_columns = model_data["X_columns"]
             self.scaler = model_data["scaler"]
-            self.model_trained = True
-            return True
-        return False
+            self.feature_layout = model_data.get("feature_layout", "onehot")
+            self.category_classes = model_data.get("category_classes", {})
+            self.model_rank = model_data.get("model_rank")
+            self.target_means = model_data.get("target_means")
+            # Modelos salvos antes das tabelas de codificação
+            self.encoding = model_data.get("encoding") or self.build_encoding_tables()
+            self.catalog = model_data.get("catalog")
+            self.training_info = model_data.get("training_info")
+            if model_data.get("compiled_tree") is not None:
+                self.compiled_tree = CompiledTree(**model_data["compiled_tree"])
+            else:
+                self.compile_model()
+        else:
+            return False
+
+        # Predições do modelo anterior não valem para o novo artefato
+        self.prediction_cache.clear()
+        self.lookup_table = None
+        self.model_trained = True
+        return True
+
+    def _load_artifact(self, dirpath):
+        """Carrega o formato versionado, abrindo os arrays com mmap"""
+        header_path = os.path.join(dirpath, ARTIFACT_HEADER)
+        if not os.path.exists(header_path):
+            print(f"Artefato incompleto em '{dirpath}'.")
+            return False
+        with open(header_path) as f:
+            header = json.load(f)
+        if header["schema_version"] > ARTIFACT_SCHEMA_VERSION:
+            print(
+                f"Versão do artefato ({header['schema_version']}) não suportada, "
+                f"máximo {ARTIFACT_SCHEMA_VERSION}."
+            )
+            return False
+
+        def load_array(name):
+            # np.asarray mantém o mapeamento em memória sem a sobrecarga do memmap
+            path = os.path.join(dirpath, f"{name}.npy")
+            return np.asarray(np.load(path, mmap_mode="r"))
+
+        self.X_columns = pd.Index(header["feature_columns"])
+
+        self.le_brand = LabelEncoder()
+        self.le_brand.classes_ = load_array("brand_classes")
+        self.le_model = LabelEncoder()
+        self.le_model.classes_ = load_array("model_classes")
+
+        # Artefatos da versão 1 só tinham o layout One-Hot
+        self.feature_layout = header.get("feature_layout", "onehot")
+        self.category_classes = {
+            col: np.asarray(classes, dtype=str)
+            for col, classes in header.get("category_classes", {}).items()
+        }
+        self.model_rank = (
+            load_array("model_rank") if self.feature_layout == "categorical" else None
+        )
+        self.target_means = (
+            {col: load_array(f"{col}_target_mean") for col in TARGET_ENCODED_COLUMNS}
+            if self.feature_layout == "target"
+            else None
+        )
+
+        self.scaler = scaler_from_range(
+            load_array("scaler_data_min"),
+            load_array("scaler_data_max"),
+            self.X_columns,
+        )
+
+        if header["estimator_format"] in ("tree_arrays", "compact_tree_arrays"):
+            names = list(TREE_ARRAYS)
+            if header["estimator_format"] == "compact_tree_arrays":
+                names.append("leaf_values")
+            self.model = None
+            self.compiled_tree = CompiledTree(
+                **{name: load_array(f"tree_{name}") for name in names}
+            )
+        else:
+            with open(os.path.join(dirpath, "estimator.pkl"), "rb") as f:
+                self.model = pickle.load(f)
+            self.compile_model()
+
+        self.encoding = self.build_encoding_tables()
+
+        self.estimator_name = header.get("estimator")
+        self.catalog = header.get("catalog")
+        self.training_info = header.get("training")
+        return True
 
 
 # Função para treinar e salvar o modelo se necessário
-def ensure_model_trained():
+def ensure_model_trained(estimator="tree"):
     """Garante que o modelo está treinado e salvo"""
-    model_path = "car_price_model.pkl"
+    model_path = MODEL_PATH
 
     if os.path.exists(model_path):
         print("Modelo já existe, carregando...")
         return True
 
+    if os.path.exists(LEGACY_MODEL_PATH):
+        print("Modelo no formato antigo encontrado, convertendo...")
+        car_model = CarPriceModel()
+        if car_model.load_model(LEGACY_MODEL_PATH):
+            # O pickle antigo não tem catálogo; montar a partir do dataset
+            if car_model.catalog is None and car_model.load_and_preprocess_data():
+                car_model.catalog = car_model.build_catalog()
+            return car_model.save_model(model_path)
+
     print("Treinando novo modelo...")
     car_model = CarPriceModel()
 
     if not car_model.load_and_preprocess_data():
         return False
 
-    if not car_model.train_model():
+    if not car_model.train_model(estimator):
         return False
 
+    if car_model.compiled_tree is not None:
+        car_model.compact_model()
     car_model.save_model(model_path)
+    if car_model.build_lookup_table() is not None:
+        car_model.lookup_table.save(LOOKUP_TABLE_PATH)
     print("Modelo treinado e salvo com sucesso!")
     return True
 
 
+def main():
+    parser = argparse.ArgumentParser(description="Modelo de preços de carros FIPE")
+    commands = parser.add_subparsers(dest="command")
+    commands.add_parser("train", help="Treinar e salvar o modelo (padrão)")
+    score = commands.add_parser("score", help="Precificar um CSV de veículos")
+    score.add_argument("input", help="CSV com as colunas de entrada do modelo")
+    score.add_argument("output", help="CSV de saída com preço e erro por linha")
+    score.add_argument("--model", default=MODEL_PATH)
+    score.add_argument("--chunksize", type=int, default=DEFAULT_CHUNKSIZE)
+    score.add_argument("--workers", type=int, default=None)
+    score.add_argument(
+        "--resume",
+        action="store_true",
+        help="Continuar de onde uma execução interrompida parou",
+    )
+    args = parser.parse_args()
+
+    if args.command == "score":
+        # Importado aqui porque scoring depende deste módulo
+        from scoring import score_csv
+
+        return score_csv(
+            args.input,
+            args.output,
+            model_path=args.model,
+            chunksize=args.chunksize,
+            workers=args.workers,
+            resume=args.resume,
+        )
+    return ensure_model_trained()
+
+
 if __name__ == "__main__":
-    ensure_model_trained()
+    sys.exit(0 if main() else 1)
@@ -0,0 +1,187 @@
+import gc
+import json
+import multiprocessing
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+from model_utils import CarPriceModel, INPUT_COLUMNS, MODEL_PATH
+from streaming import DEFAULT_CHUNKSIZE
+
+# Colunas acrescentadas a cada linha do arquivo de saída
+PRICE_COLUMN = "predicted_price"
+ERROR_COLUMN = "prediction_error"
+
+# Blocos em processamento por worker; limita a memória do processo principal
+CHUNKS_IN_FLIGHT_PER_WORKER = 2
+
+
+def progress_path_for(output_path):
+    """Arquivo com o progresso gravado, ao lado da saída"""
+    return output_path + ".progress"
+
+
+def _read_progress(output_path):
+    try:
+        with open(progress_path_for(output_path)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_progress(output_path, progress):
+    # Troca atômica: uma interrupção nunca deixa o progresso pela metade
+    path = progress_path_for(output_path)
+    with open(path + ".tmp", "w") as f:
+        json.dump(progress, f)
+    os.replace(path + ".tmp", path)
+
+
+# Modelo de cada processo do pool; com fork é herdado do processo principal
+_worker_model = None
+
+
+def _init_worker(model_path):
+    global _worker_model
+    if _worker_model is None:
+        _worker_model = CarPriceModel()
+        _worker_model.load_model(model_path)
+
+
+def _score_chunk(chunk):
+    """Prevê um bloco; retorna (preços, erros)"""
+    return _worker_model.predict_batch(chunk, return_errors=True)
+
+
+def score_csv(
+    input_path,
+    output_path,
+    model_path=MODEL_PATH,
+    chunksize=DEFAULT_CHUNKSIZE,
+    workers=None,
+    resume=False,
+    encoding="latin1",
+):
+    """Precifica um CSV de veículos em blocos, com um pool de processos
+
+    A saída repete as colunas da entrada e acrescenta o preço previsto e a
+    mensagem de erro de cada linha. Todas as colunas são lidas como texto,
+    sem converter vazios em NaN, então os valores saem exatamente como
+    entraram (zeros à esquerda, inteiros sem ".0") e não dependem de onde
+    caem as divisões dos blocos; `predict_batch` converte os números.
+
+    Os blocos são gravados na ordem da entrada e, após cada um, o número de
+    linhas e de bytes gravados vai para `<saída>.progress`; com
+    `resume=True` a saída é truncada nesse ponto e a leitura recomeça na
+    linha seguinte. No máximo CHUNKS_IN_FLIGHT_PER_WORKER blocos por worker
+    ficam em memória.
+    """
+    global _worker_model
+    if not os.path.exists(input_path):
+        print(f"Arquivo '{input_path}' não encontrado.")
+        return None
+
+    workers = workers or os.cpu_count() or 1
+    progress = None
+    if resume and os.path.exists(output_path):
+        progress = _read_progress(output_path)
+    if resume and progress is None:
+        print("Nenhum progresso salvo; começando do início.")
+    offset = progress["rows"] if progress else 0
+
+    # Carregar uma vez aqui; com fork os workers herdam o modelo pronto
+    _worker_model = CarPriceModel()
+    if not _worker_model.load_model(model_path):
+        return None
+
+    # O cabeçalho é lido à parte para pular as linhas já gravadas com um
+    # inteiro; uma lista de linhas a pular ocuparia GBs em offsets grandes
+    columns = pd.read_csv(input_path, nrows=0, encoding=encoding).columns
+    reader = pd.read_csv(
+        input_path,
+        chunksize=chunksize,
+        encoding=encoding,
+        dtype=str,
+        keep_default_na=False,
+        header=None,
+        names=columns,
+        skiprows=offset + 1,
+    )
+
+    if progress:
+        with open(output_path, "r+b") as f:
+            f.truncate(progress["bytes"])
+        print(f"Retomando a partir da linha {offset:,}.")
+    else:
+        open(output_path, "wb").close()
+
+    executor = None
+    if workers > 1:
+        # Mantém o modelo fora da coleta de lixo para as páginas herdadas
+        # continuarem compartilhadas entre os workers
+        gc.freeze()
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context("fork" if "fork" in methods else None)
+        executor = ProcessPoolExecutor(
+            workers,
+            mp_context=context,
+            initializer=_init_worker,
+            initargs=(model_path,),
+        )
+
+    stats = {"rows": 0, "errors": 0}
+    start = time.perf_counter()
+
+    def write(chunk, prices, errors):
+        chunk[PRICE_COLUMN] = prices
+        chunk[ERROR_COLUMN] = errors
+        with open(output_path, "ab") as f:
+            header = offset + stats["rows"] == 0
+            chunk.to_csv(f, header=header, index=False, encoding=encoding)
+            size = f.tell()
+        stats["rows"] += len(chunk)
+        stats["errors"] += int(pd.notna(errors).sum())
+        _write_progress(output_path, {"rows": offset + stats["rows"], "bytes": size})
+
+        elapsed = time.perf_counter() - start
+        print(
+            f"{offset + stats['rows']:,} linhas precificadas "
+            f"({stats['rows'] / elapsed:,.0f} linhas/s)"
+        )
+
+    try:
+        pending = deque()
+        for chunk in reader:
+            missing = [col for col in INPUT_COLUMNS if col not in chunk.columns]
+            if missing:
+                print(f"Colunas ausentes no arquivo: {missing}")
+                return None
+            if executor is None:
+                write(chunk, *_score_chunk(chunk[INPUT_COLUMNS]))
+                continue
+            pending.append((chunk, executor.submit(_score_chunk, chunk[INPUT_COLUMNS])))
+            # Janela limitada: grava o bloco mais antigo antes de ler outro
+            while len(pending) >= workers * CHUNKS_IN_FLIGHT_PER_WORKER:
+                chunk, future = pending.popleft()
+                write(chunk, *future.result())
+        while pending:
+            chunk, future = pending.popleft()
+            write(chunk, *future.result())
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+
+    elapsed = time.perf_counter() - start
+    summary = {
+        "rows": stats["rows"],
+        "errors": stats["errors"],
+        "seconds": elapsed,
+        "rows_per_second": stats["rows"] / elapsed if elapsed else 0.0,
+    }
+    print(
+        f"Concluído: {summary['rows']:,} linhas em {elapsed:.1f}s "
+        f"({summary['rows_per_second']:,.0f} linhas/s), "
+        f"{summary['errors']:,} com erro. Saída em '{output_path}'."
+    )
+    return summary
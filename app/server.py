@@ -0,0 +1,413 @@
+import argparse
+import gc
+import json
+import os
+import signal
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+from model_utils import CarPriceModel, INPUT_COLUMNS, MODEL_PATH
+from batching import MAX_BATCH_SIZE, MAX_WAIT_MS, PredictionBatcher
+
+# Limites de uma requisição
+MAX_BODY_BYTES = 10 * 1024 * 1024
+MAX_BATCH_ROWS = 10_000
+
+
+def load_serving_model(model_path=MODEL_PATH):
+    """Carrega o modelo servido pela API e pela aplicação Streamlit
+
+    Lê o artefato e a tabela de preços pré-computados. Retorna None se o
+    modelo (ou, para artefatos antigos, o dataset) não puder ser carregado.
+    """
+    car_model = CarPriceModel()
+    if not car_model.load_model(model_path):
+        return None
+    # Artefatos sem catálogo ainda dependem do dataset
+    if car_model.catalog is None:
+        if not car_model.load_and_preprocess_data():
+            return None
+        car_model.catalog = car_model.build_catalog()
+    car_model.load_lookup_table()
+    return car_model
+
+
+def process_memory(pid="self"):
+    """Memória de um processo em MB, lida de /proc/<pid>/smaps_rollup
+
+    RSS conta cada página compartilhada inteira em todos os processos; PSS
+    divide a página entre os processos que a usam e USS soma só as páginas
+    exclusivas do processo. Retorna None fora do Linux.
+    """
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            # A primeira linha é o intervalo de endereços do resumo
+            lines = f.readlines()[1:]
+    except OSError:
+        return None
+    fields = {}
+    for line in lines:
+        name, value = line.split(":", 1)
+        fields[name] = int(value.split()[0])
+
+    def mb(*names):
+        return sum(fields.get(name, 0) for name in names) / 1024
+
+    return {
+        "rss_mb": mb("Rss"),
+        "pss_mb": mb("Pss"),
+        "uss_mb": mb("Private_Clean", "Private_Dirty"),
+        "shared_mb": mb("Shared_Clean", "Shared_Dirty"),
+    }
+
+
+def print_memory_report(pids):
+    """Imprime RSS/PSS/USS do processo atual e dos workers"""
+    print(f"{'processo':>12} {'RSS':>9} {'PSS':>9} {'USS':>9}  (MB)")
+    total_pss = 0.0
+    for label, pid in [("principal", os.getpid())] + [
+        (f"worker {pid}", pid) for pid in pids
+    ]:
+        memory = process_memory(pid)
+        if memory is None:
+            continue
+        total_pss += memory["pss_mb"]
+        print(
+            f"{label:>12} {memory['rss_mb']:9.1f} {memory['pss_mb']:9.1f} "
+            f"{memory['uss_mb']:9.1f}"
+        )
+    print(f"{'PSS total':>12} {total_pss:9.1f}")
+
+
+class RequestError(Exception):
+    """Erro de requisição respondido com `status` e a mensagem em JSON"""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class PredictionServer(ThreadingHTTPServer):
+    """Servidor HTTP com uma thread por conexão em torno de um CarPriceModel
+
+    `car_model` fica None até o modelo terminar de carregar; enquanto isso
+    /ready e as predições respondem 503. Predições avulsas passam por um
+    PredictionBatcher, a menos que `max_batch_size` seja 1.
+    """
+
+    daemon_threads = True
+    # Fila de conexões maior para picos de centenas de requisições por segundo
+    request_queue_size = 128
+
+    def __init__(
+        self,
+        address,
+        car_model=None,
+        max_batch_size=MAX_BATCH_SIZE,
+        max_wait_ms=MAX_WAIT_MS,
+        bind_and_activate=True,
+    ):
+        super().__init__(address, PredictionHandler, bind_and_activate)
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.car_model = None
+        self.batcher = None
+        self._catalog_body = None
+        if car_model is not None:
+            self.set_model(car_model)
+
+    def set_model(self, car_model):
+        self._catalog_body = json.dumps(car_model.catalog).encode("utf-8")
+        if self.max_batch_size > 1:
+            self.batcher = PredictionBatcher(
+                car_model, self.max_batch_size, self.max_wait_ms
+            )
+        self.car_model = car_model
+
+    def load_model_async(self, model_path=MODEL_PATH):
+        """Carrega o modelo em segundo plano enquanto o servidor já responde"""
+
+        def load():
+            car_model = load_serving_model(model_path)
+            if car_model is None:
+                print(f"Não foi possível carregar o modelo em '{model_path}'.")
+                return
+            self.set_model(car_model)
+
+        threading.Thread(target=load, name="model-loader", daemon=True).start()
+
+
+class PredictionHandler(BaseHTTPRequestHandler):
+    # Keep-alive: clientes reaproveitam a conexão entre requisições
+    protocol_version = "HTTP/1.1"
+    # Cabeçalhos e corpo saem em escritas separadas; com Nagle cada resposta
+    # esperaria o ACK atrasado do cliente (~40 ms)
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        # O log por requisição custa mais que a própria predição
+        pass
+
+    def do_GET(self):
+        self.dispatch(
+            {
+                "/health": self.handle_health,
+                "/ready": self.handle_ready,
+                "/catalog": self.handle_catalog,
+                "/metrics": self.handle_metrics,
+            }
+        )
+
+    def do_POST(self):
+        self.dispatch(
+            {
+                "/predict": self.handle_predict,
+                "/predict/batch": self.handle_predict_batch,
+            }
+        )
+
+    def dispatch(self, routes):
+        url = urlparse(self.path)
+        self.query = parse_qs(url.query)
+        handler = routes.get(url.path.rstrip("/") or "/")
+        self.body_read = False
+        try:
+            if handler is None:
+                raise RequestError(404, f"Rota não encontrada: {url.path}")
+            handler()
+        except RequestError as e:
+            self.discard_body()
+            self.send_json(e.status, {"error": str(e)})
+        except Exception as e:
+            print(f"Erro ao processar {self.command} {url.path}: {e}")
+            self.discard_body()
+            self.send_json(500, {"error": "Erro interno"})
+
+    def send_json(self, status, payload=None, body=None):
+        if body is None:
+            body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        if self.close_connection:
+            self.send_header("Connection", "close")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def content_length(self):
+        """Content-Length da requisição; None se inválido ou negativo"""
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+        except ValueError:
+            return None
+        return length if length >= 0 else None
+
+    def discard_body(self):
+        """Consome o corpo que o handler não leu
+
+        Com keep-alive, bytes não lidos seriam interpretados como o início da
+        próxima requisição; corpos grandes ou de tamanho inválido fecham a
+        conexão em vez de serem lidos.
+        """
+        if self.body_read:
+            return
+        self.body_read = True
+        length = self.content_length()
+        if length is None or length > MAX_BODY_BYTES:
+            self.close_connection = True
+        elif length:
+            self.rfile.read(length)
+
+    def read_json(self):
+        length = self.content_length()
+        if length is None:
+            raise RequestError(400, "Content-Length inválido")
+        if length > MAX_BODY_BYTES:
+            raise RequestError(413, "Corpo da requisição muito grande")
+        self.body_read = True
+        try:
+            return json.loads(self.rfile.read(length) or b"null")
+        except (UnicodeDecodeError, json.JSONDecodeError):
+            raise RequestError(400, "JSON inválido")
+
+    def require_model(self):
+        if self.server.car_model is None:
+            raise RequestError(503, "Modelo ainda não carregado")
+        return self.server.car_model
+
+    def handle_health(self):
+        self.send_json(200, {"status": "ok", "pid": os.getpid()})
+
+    def handle_ready(self):
+        self.require_model()
+        self.send_json(200, {"status": "ready"})
+
+    def handle_catalog(self):
+        """Catálogo completo, ou os modelos de uma marca com ?brand="""
+        car_model = self.require_model()
+        if "brand" in self.query:
+            brand = self.query["brand"][0]
+            models = car_model.get_models_by_brand(brand)
+            if not models:
+                raise RequestError(404, f"Marca desconhecida: {brand}")
+            self.send_json(200, {"brand": brand, "models": list(models)})
+            return
+        self.send_json(200, body=self.server._catalog_body)
+
+    def handle_metrics(self):
+        """Cache de predições e, com agrupamento, lotes e espera na fila"""
+        car_model = self.require_model()
+        batcher = self.server.batcher
+        self.send_json(
+            200,
+            {
+                "pid": os.getpid(),
+                "memory": process_memory(),
+                "cache": car_model.cache_info(),
+                "batching": batcher.metrics() if batcher is not None else None,
+            },
+        )
+
+    def handle_predict(self):
+        car_model = self.require_model()
+        car = self.read_json()
+        if not isinstance(car, dict):
+            raise RequestError(400, "Esperado um objeto JSON com os dados do carro")
+        missing = [col for col in INPUT_COLUMNS if col not in car]
+        if missing:
+            raise RequestError(400, f"Campos ausentes: {missing}")
+
+        if self.server.batcher is not None:
+            price, error = self.server.batcher.predict(car)
+        else:
+            price, error = car_model.predict_price(
+                *(car[col] for col in INPUT_COLUMNS), return_error=True
+            )
+        if error is not None:
+            raise RequestError(422, error)
+        self.send_json(200, {"price": float(price)})
+
+    def handle_predict_batch(self):
+        """Recebe {"cars": [...]} e responde preços e erros na mesma ordem"""
+        car_model = self.require_model()
+        payload = self.read_json()
+        cars = payload.get("cars") if isinstance(payload, dict) else None
+        if not isinstance(cars, list) or not all(isinstance(c, dict) for c in cars):
+            raise RequestError(400, 'Esperado {"cars": [objetos]}')
+        if len(cars) > MAX_BATCH_ROWS:
+            raise RequestError(413, f"Máximo de {MAX_BATCH_ROWS} carros por lote")
+
+        missing = [col for col in INPUT_COLUMNS if any(col not in c for c in cars)]
+        if missing:
+            raise RequestError(400, f"Campos ausentes: {missing}")
+
+        car_columns = {col: [car[col] for car in cars] for col in INPUT_COLUMNS}
+        prices, errors = car_model.predict_batch(car_columns, return_errors=True)
+        self.send_json(
+            200,
+            {
+                "prices": [
+                    None if error is not None else float(price)
+                    for price, error in zip(prices, errors)
+                ],
+                "errors": list(errors),
+            },
+        )
+
+
+def run_worker(server, model_path, car_model=None):
+    """Atende requisições até receber SIGTERM
+
+    Sem `car_model` pré-carregado, o worker carrega o próprio modelo.
+    """
+    signal.signal(signal.SIGTERM, lambda *_: os._exit(0))
+    if car_model is not None:
+        server.set_model(car_model)
+    else:
+        server.load_model_async(model_path)
+    server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="API HTTP de predição de preços")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--model", default=MODEL_PATH)
+    parser.add_argument(
+        "--max-batch-size",
+        type=int,
+        default=MAX_BATCH_SIZE,
+        help="Linhas por lote de /predict (1 desliga o agrupamento)",
+    )
+    parser.add_argument(
+        "--max-wait-ms",
+        type=float,
+        default=MAX_WAIT_MS,
+        help="Espera máxima de um pedido pelo seu lote",
+    )
+    parser.add_argument(
+        "--preload",
+        action=argparse.BooleanOptionalAction,
+        default=True,
+        help="Carregar o modelo uma vez antes do fork e compartilhar a memória",
+    )
+    args = parser.parse_args()
+
+    car_model = None
+    if args.preload:
+        car_model = load_serving_model(args.model)
+        if car_model is None:
+            print(f"Não foi possível carregar o modelo em '{args.model}'.")
+            return
+        # Tudo o que foi carregado vai para a geração permanente: a coleta de
+        # lixo dos workers não escreve nesses objetos e as páginas continuam
+        # compartilhadas por copy-on-write
+        gc.collect()
+        gc.freeze()
+
+    # O socket é aberto antes do fork: os workers aceitam conexões dele
+    server = PredictionServer(
+        (args.host, args.port),
+        max_batch_size=args.max_batch_size,
+        max_wait_ms=args.max_wait_ms,
+    )
+    print(f"Servindo em http://{args.host}:{args.port} com {args.workers} worker(s)")
+
+    if args.workers == 1 or not hasattr(os, "fork"):
+        try:
+            run_worker(server, args.model, car_model)
+        except KeyboardInterrupt:
+            pass
+        return
+
+    children = []
+    for _ in range(args.workers):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                run_worker(server, args.model, car_model)
+            finally:
+                os._exit(0)
+        children.append(pid)
+
+    def stop(*_):
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    # kill -USR1 <pid do processo principal> mostra a memória de cada worker
+    signal.signal(signal.SIGUSR1, lambda *_: print_memory_report(children))
+    try:
+        for pid in children:
+            os.waitpid(pid, 0)
+    except KeyboardInterrupt:
+        stop()
+    server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,31 @@
+import os
+import shutil
+import tempfile
+
+
+def publish_dir(tmp_dir, target):
+    """Publica o diretório completo `tmp_dir` no lugar de `target`
+
+    O diretório antigo é primeiro renomeado para fora do caminho e só então
+    apagado, então um leitor encontra o diretório antigo inteiro, o novo
+    inteiro ou, por um instante entre as duas renomeações, nenhum (tratado
+    como cache ausente), nunca um diretório apagado pela metade. Retorna
+    False se outro processo publicou `target` ao mesmo tempo; nesse caso
+    `tmp_dir` é descartado.
+    """
+    parent = os.path.dirname(os.path.abspath(target))
+    trash = tempfile.mkdtemp(prefix=".old-", dir=parent)
+    try:
+        try:
+            os.rename(target, os.path.join(trash, "old"))
+        except FileNotFoundError:
+            pass
+        try:
+            os.rename(tmp_dir, target)
+        except OSError:
+            # Outro processo publicou o mesmo diretório ao mesmo tempo
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            return False
+        return True
+    finally:
+        shutil.rmtree(trash, ignore_errors=True)
@@ -0,0 +1,131 @@
+import numpy as np
+import pandas as pd
+from sklearn.base import BaseEstimator, RegressorMixin, clone
+from sklearn.linear_model import SGDRegressor
+
+# Linhas lidas do CSV por vez no treino em streaming
+DEFAULT_CHUNKSIZE = 100_000
+
+# Resolução da divisão treino/teste por hash (frações em passos de 0,01%)
+HOLDOUT_BUCKETS = 10_000
+
+# Categorias trocadas pela média do preço no treino; um modelo linear não
+# aprende nada com os códigos arbitrários do LabelEncoder
+TARGET_ENCODED_COLUMNS = ["brand", "model"]
+# Peso da média geral na média de cada categoria (em linhas): categorias
+# raras ficam perto da média geral
+TARGET_ENCODING_SMOOTHING = 10
+
+
+class ScaledTargetRegressor(BaseEstimator, RegressorMixin):
+    """Regressor incremental treinado sobre o preço padronizado
+
+    Preços em reais têm escala de 10^5, o que desestabiliza a descida de
+    gradiente do SGDRegressor; o alvo é padronizado com a média e o desvio
+    calculados na primeira passada e a predição volta para reais.
+    """
+
+    def __init__(self, estimator=None, y_mean=0.0, y_scale=1.0):
+        self.estimator = estimator
+        self.y_mean = y_mean
+        self.y_scale = y_scale
+
+    def partial_fit(self, X, y):
+        if not hasattr(self, "estimator_"):
+            self.estimator_ = clone(self.estimator or SGDRegressor(random_state=42))
+        y = (np.asarray(y, dtype=np.float64) - self.y_mean) / self.y_scale
+        self.estimator_.partial_fit(X, y)
+        return self
+
+    def predict(self, X):
+        return self.estimator_.predict(X) * self.y_scale + self.y_mean
+
+
+def target_means(sums, counts, classes, prior, smoothing=TARGET_ENCODING_SMOOTHING):
+    """Média suavizada do alvo para cada categoria de `classes`
+
+    Categorias sem linhas de treino recebem a média geral `prior`.
+    """
+    sums = np.array([sums.get(c, 0.0) for c in classes], dtype=np.float64)
+    counts = np.array([counts.get(c, 0) for c in classes], dtype=np.float64)
+    return (sums + smoothing * prior) / (counts + smoothing)
+
+
+def holdout_mask(chunk, holdout_fraction):
+    """Marca as linhas de teste pelo hash do conteúdo da linha
+
+    A divisão não depende da ordem nem do tamanho dos blocos, então é a mesma
+    em todas as passadas sobre o arquivo.
+    """
+    hashes = pd.util.hash_pandas_object(chunk, index=False).to_numpy()
+    return hashes % HOLDOUT_BUCKETS < int(holdout_fraction * HOLDOUT_BUCKETS)
+
+
+def iter_chunks(csv_path, usecols, chunksize=DEFAULT_CHUNKSIZE, encoding="latin1"):
+    """Lê o CSV em blocos, sem nulos e sem duplicatas dentro de cada bloco"""
+    reader = pd.read_csv(
+        csv_path, usecols=usecols, chunksize=chunksize, encoding=encoding
+    )
+    for chunk in reader:
+        yield chunk.dropna().drop_duplicates()
+
+
+def scan_csv(
+    csv_path,
+    usecols,
+    target,
+    holdout_fraction,
+    chunksize=DEFAULT_CHUNKSIZE,
+    encoding="latin1",
+):
+    """Primeira passada: coleta categorias, limites numéricos e o alvo
+
+    Guarda apenas agregados (conjuntos de categorias, contagens, mínimos,
+    máximos e a soma do alvo por categoria de TARGET_ENCODED_COLUMNS no
+    treino), então a memória não cresce com o número de linhas.
+    """
+    columns = pd.read_csv(csv_path, nrows=0, encoding=encoding).columns
+    stats = {
+        "columns": [col for col in columns if col in usecols],
+        "n_rows": 0,
+        "n_train": 0,
+        "n_test": 0,
+        "min": {},
+        "max": {},
+        "counts": {},
+        "models_by_brand": {},
+        "y_sum": 0.0,
+        "y_sum_sq": 0.0,
+        "target_sums": {col: {} for col in TARGET_ENCODED_COLUMNS},
+        "target_counts": {col: {} for col in TARGET_ENCODED_COLUMNS},
+    }
+    for chunk in iter_chunks(csv_path, usecols, chunksize, encoding):
+        stats["n_rows"] += len(chunk)
+        for col in chunk.columns:
+            if pd.api.types.is_numeric_dtype(chunk[col]):
+                low, high = chunk[col].min(), chunk[col].max()
+                stats["min"][col] = min(stats["min"].get(col, low), low)
+                stats["max"][col] = max(stats["max"].get(col, high), high)
+            else:
+                counts = stats["counts"].setdefault(col, {})
+                for value, count in chunk[col].value_counts().items():
+                    counts[value] = counts.get(value, 0) + int(count)
+
+        for brand, models in chunk.groupby("brand")["model"].unique().items():
+            stats["models_by_brand"].setdefault(brand, set()).update(models)
+
+        train = chunk.loc[~holdout_mask(chunk, holdout_fraction)]
+        y_train = train[target]
+        for col in TARGET_ENCODED_COLUMNS:
+            sums = stats["target_sums"][col]
+            counts = stats["target_counts"][col]
+            grouped = y_train.astype(np.float64).groupby(train[col])
+            for value, (total, count) in grouped.agg(["sum", "count"]).iterrows():
+                sums[value] = sums.get(value, 0.0) + total
+                counts[value] = counts.get(value, 0) + int(count)
+
+        stats["n_train"] += len(y_train)
+        stats["n_test"] += len(chunk) - len(y_train)
+        stats["y_sum"] += float(y_train.sum())
+        stats["y_sum_sq"] += float((y_train.astype(np.float64) ** 2).sum())
+    return stats
@@ -0,0 +1,238 @@
+import numpy as np
+
+# Marcador de folha usado pelo sklearn em children_left/children_right
+TREE_LEAF = -1
+# Feature/limiar usados pelo sklearn nas folhas
+TREE_UNDEFINED = -2
+
+# Número de níveis descidos entre duas compactações das linhas ativas
+LEVELS_PER_COMPACTION = 4
+
+
+def narrowest_int(max_value):
+    """Menor tipo inteiro com sinal capaz de guardar `max_value`"""
+    for dtype in (np.int8, np.int16, np.int32):
+        if max_value <= np.iinfo(dtype).max:
+            return dtype
+    return np.int64
+
+
+def round_down_float32(values):
+    """Converte para float32 arredondando para baixo
+
+    Para x em float32, `x <= t` vale exatamente quando `x <= t32`, onde t32 é
+    o maior float32 menor ou igual a t; por isso o limiar reduzido mantém as
+    predições idênticas.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    rounded = values.astype(np.float32)
+    too_high = rounded.astype(np.float64) > values
+    rounded[too_high] = np.nextafter(rounded[too_high], np.float32(-np.inf))
+    return rounded
+
+
+class CompiledTree:
+    """Árvore de decisão exportada para arrays planos do NumPy
+
+    Reproduz exatamente o `predict` de um DecisionTreeRegressor treinado, sem
+    a validação de entrada e o despacho do sklearn a cada chamada.
+
+    Com `leaf_values`, a árvore está no formato compacto: `value` guarda o
+    índice de cada folha em `leaf_values` (valores distintos das folhas).
+    """
+
+    def __init__(self, feature, threshold, left, right, value, leaf_values=None):
+        self.feature = feature
+        self.threshold = threshold
+        self.left = left
+        self.right = right
+        self.value = value
+        self.leaf_values = leaf_values
+        self._build_traversal_arrays()
+
+    @classmethod
+    def from_sklearn(cls, estimator):
+        """Exporta um DecisionTreeRegressor treinado para arrays planos"""
+        tree = estimator.tree_
+        return cls(
+            feature=np.array(tree.feature, dtype=np.int64),
+            threshold=np.array(tree.threshold, dtype=np.float64),
+            left=np.array(tree.children_left, dtype=np.int64),
+            right=np.array(tree.children_right, dtype=np.int64),
+            value=np.array(tree.value[:, 0, 0], dtype=np.float64),
+        )
+
+    @property
+    def node_count(self):
+        return len(self.value)
+
+    @property
+    def arrays(self):
+        """Arrays que definem a árvore, na ordem do construtor"""
+        arrays = {
+            "feature": self.feature,
+            "threshold": self.threshold,
+            "left": self.left,
+            "right": self.right,
+            "value": self.value,
+        }
+        if self.leaf_values is not None:
+            arrays["leaf_values"] = self.leaf_values
+        return arrays
+
+    @property
+    def nbytes(self):
+        """Bytes ocupados pelos arrays da árvore e pelos de percurso"""
+        traversal = (self._is_leaf, self._feature, self._threshold, self._children)
+        return sum(array.nbytes for array in self.arrays.values()) + sum(
+            array.nbytes for array in traversal
+        )
+
+    def prune(self, node_cost, alpha):
+        """Poda por custo-complexidade, sem retreinar a árvore
+
+        Mantém a subárvore que minimiza R(T) + alpha * (número de folhas),
+        onde `node_cost` é R de cada nó (impureza ponderada pela fração de
+        amostras, a mesma medida do `ccp_alpha` do sklearn). Os nós do sklearn
+        estão em pré-ordem, então percorrê-los de trás para frente resolve a
+        programação dinâmica em uma passada.
+        """
+        if self.leaf_values is not None:
+            raise ValueError("Poda requer a árvore completa (não compactada)")
+
+        left, right = self.left.tolist(), self.right.tolist()
+        cost = np.asarray(node_cost, dtype=np.float64).tolist()
+        subtree_cost = [0.0] * self.node_count
+        collapse = [False] * self.node_count
+        for node in range(self.node_count - 1, -1, -1):
+            as_leaf = cost[node] + alpha
+            if left[node] == TREE_LEAF:
+                subtree_cost[node] = as_leaf
+                continue
+            children = subtree_cost[left[node]] + subtree_cost[right[node]]
+            collapse[node] = as_leaf <= children
+            subtree_cost[node] = min(as_leaf, children)
+
+        # Renumerar os nós mantidos, preservando a pré-ordem
+        order = []
+        stack = [0]
+        while stack:
+            node = stack.pop()
+            order.append(node)
+            if left[node] != TREE_LEAF and not collapse[node]:
+                stack.append(right[node])
+                stack.append(left[node])
+        order = np.array(order, dtype=np.intp)
+        new_index = np.full(self.node_count, TREE_LEAF, dtype=np.int64)
+        new_index[order] = np.arange(len(order))
+
+        is_leaf = (self.left[order] == TREE_LEAF) | np.array(collapse)[order]
+        return CompiledTree(
+            feature=np.where(is_leaf, TREE_UNDEFINED, self.feature[order]),
+            threshold=np.where(is_leaf, TREE_UNDEFINED, self.threshold[order]),
+            left=np.where(is_leaf, TREE_LEAF, new_index[self.left[order]]),
+            right=np.where(is_leaf, TREE_LEAF, new_index[self.right[order]]),
+            value=self.value[order],
+        )
+
+    def compact(self):
+        """Retorna uma cópia com tipos reduzidos e folhas deduplicadas
+
+        Limiares em float32 (arredondados para baixo), índices de filhos e de
+        features no menor inteiro possível e cada valor de folha guardado uma
+        única vez. As predições continuam idênticas.
+        """
+        is_leaf = self.left == TREE_LEAF
+        values = (
+            self.value if self.leaf_values is None else self.leaf_values[self.value]
+        )
+        leaf_values, leaf_index = np.unique(values[is_leaf], return_inverse=True)
+        value = np.zeros(self.node_count, dtype=narrowest_int(len(leaf_values)))
+        value[is_leaf] = leaf_index
+
+        index_dtype = narrowest_int(self.node_count)
+        return CompiledTree(
+            feature=self.feature.astype(narrowest_int(max(self.feature.max(), 0))),
+            threshold=round_down_float32(self.threshold),
+            left=self.left.astype(index_dtype),
+            right=self.right.astype(index_dtype),
+            value=value,
+            leaf_values=leaf_values.astype(np.float64),
+        )
+
+    def _build_traversal_arrays(self):
+        """Prepara os arrays usados na descida vetorizada
+
+        As folhas apontam para si mesmas com limiar infinito, então uma linha
+        que já chegou a uma folha pode continuar "descendo" sem mudar de nó.
+        Os filhos ficam intercalados (direito, esquerdo) para que cada nível
+        custe uma única leitura.
+        """
+        is_leaf = self.left == TREE_LEAF
+        nodes = np.arange(self.node_count)
+        self._is_leaf = is_leaf
+        self._feature = np.where(is_leaf, 0, self.feature).astype(np.intp)
+        self._threshold = np.where(is_leaf, np.inf, self.threshold).astype(
+            self.threshold.dtype
+        )
+        # Índices em intp: índices estreitos são convertidos a cada acesso e
+        # deixam a descida mais lenta
+        self._children = np.empty(2 * self.node_count, dtype=np.intp)
+        self._children[0::2] = np.where(is_leaf, nodes, self.right)
+        self._children[1::2] = np.where(is_leaf, nodes, self.left)
+
+    def predict(self, X):
+        """Prevê os valores para uma matriz de features"""
+        # O sklearn compara as features em float32 com limiares em float64
+        X = np.asarray(X, dtype=np.float32)
+        if X.ndim == 1:
+            X = X.reshape(1, -1)
+
+        if len(X) == 1:
+            return self._leaf_value(np.array([self._find_leaf(X[0])]))
+
+        return self._leaf_value(self._find_leaves(X))
+
+    def _leaf_value(self, leaves):
+        values = self.value[leaves]
+        if self.leaf_values is not None:
+            values = self.leaf_values[values]
+        return values
+
+    def _find_leaf(self, x):
+        """Percorre a árvore para uma única linha"""
+        feature, threshold = self.feature, self.threshold
+        left, right = self.left, self.right
+        node = 0
+        while left[node] != TREE_LEAF:
+            if x[feature[node]] <= threshold[node]:
+                node = left[node]
+            else:
+                node = right[node]
+        return node
+
+    def _find_leaves(self, X):
+        """Desce a árvore nível a nível para todas as linhas de uma vez"""
+        n_rows, n_features = X.shape
+        X_flat = np.ascontiguousarray(X).ravel()
+        leaves = np.zeros(n_rows, dtype=np.intp)
+
+        rows = np.arange(n_rows, dtype=np.intp)
+        offsets = rows * n_features
+        current = np.zeros(n_rows, dtype=np.intp)
+        while rows.size:
+            for _ in range(LEVELS_PER_COMPACTION):
+                go_left = (
+                    X_flat[offsets + self._feature[current]] <= self._threshold[current]
+                )
+                current = self._children[2 * current + go_left]
+
+            # Remover as linhas que já chegaram a uma folha
+            at_leaf = self._is_leaf[current]
+            if at_leaf.any():
+                leaves[rows[at_leaf]] = current[at_leaf]
+                descending = ~at_leaf
+                rows = rows[descending]
+                offsets = offsets[descending]
+                current = current[descending]
+        return leaves
@@ -0,0 +1,271 @@
+import argparse
+import hashlib
+import json
+import math
+import sqlite3
+import time
+import numpy as np
+from joblib import Parallel, delayed
+from sklearn.metrics import mean_absolute_error
+from sklearn.model_selection import KFold, ParameterGrid
+from model_utils import CarPriceModel, ESTIMATORS
+
+# Grades do notebook (param_DecisionTree / param_RandomForest)
+PARAM_GRIDS = {
+    "tree": {
+        "max_features": ["sqrt", "log2", None],
+        "criterion": ["squared_error", "friedman_mse"],
+        "splitter": ["best", "random"],
+    },
+    "random_forest": {
+        "n_estimators": [20, 25, 30],
+        "max_features": ["sqrt", "log2"],
+    },
+    "extra_trees": {
+        "n_estimators": [20, 30, 50],
+        "max_features": ["sqrt", "log2", None],
+    },
+    "hist_gradient_boosting": {
+        "learning_rate": [0.05, 0.1, 0.2],
+        "max_leaf_nodes": [31, 63, 127],
+        "max_iter": [300],
+    },
+}
+
+TUNING_CACHE_PATH = "tuning_cache.db"
+
+
+class ScoreCache:
+    """Cache em SQLite de (configuração, fold) -> score"""
+
+    def __init__(self, path=TUNING_CACHE_PATH):
+        self.conn = sqlite3.connect(path)
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS scores (
+                key TEXT PRIMARY KEY,
+                estimator TEXT,
+                params TEXT,
+                n_resources INTEGER,
+                fold INTEGER,
+                score REAL,
+                fit_seconds REAL
+            )
+        """
+        )
+        self.conn.commit()
+
+    def get_many(self, keys):
+        """Retorna {chave: score} para as chaves já calculadas"""
+        found = {}
+        keys = list(keys)
+        for i in range(0, len(keys), 500):
+            chunk = keys[i : i + 500]
+            placeholders = ",".join("?" * len(chunk))
+            rows = self.conn.execute(
+                f"SELECT key, score FROM scores WHERE key IN ({placeholders})", chunk
+            )
+            found.update(rows)
+        return found
+
+    def put_many(self, rows):
+        """Grava linhas (key, estimator, params, n_resources, fold, score, s)"""
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO scores VALUES (?, ?, ?, ?, ?, ?, ?)", rows
+        )
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+
+def dataset_fingerprint(X, y):
+    """Hash do conteúdo de X e y, usado para invalidar o cache de scores"""
+    digest = hashlib.sha256()
+    digest.update(np.ascontiguousarray(X, dtype=np.float64).tobytes())
+    digest.update(np.ascontiguousarray(y, dtype=np.float64).tobytes())
+    return digest.hexdigest()
+
+
+def _task_key(fingerprint, estimator_name, params, n_resources, fold, n_splits, seed):
+    payload = json.dumps(
+        [fingerprint, estimator_name, params, n_resources, fold, n_splits, seed],
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _fit_and_score(estimator_name, params, X, y, train_idx, test_idx):
+    """Treina uma configuração em um fold e retorna o MAE negativo"""
+    model = ESTIMATORS[estimator_name](1, **params)
+    start = time.perf_counter()
+    model.fit(X[train_idx], y[train_idx])
+    fit_seconds = time.perf_counter() - start
+    score = -mean_absolute_error(y[test_idx], model.predict(X[test_idx]))
+    return score, fit_seconds
+
+
+def successive_halving(
+    estimator_name,
+    X,
+    y,
+    param_grid=None,
+    n_splits=5,
+    factor=3,
+    min_resources=None,
+    n_jobs=-1,
+    cache_path=TUNING_CACHE_PATH,
+    random_state=42,
+    verbose=True,
+):
+    """Busca de hiperparâmetros por successive halving com cache em disco
+
+    Cada rodada avalia os candidatos restantes com validação cruzada em uma
+    amostra de `n_resources` linhas e mantém só o melhor 1/`factor`; a amostra
+    cresce `factor` vezes por rodada até o dataset inteiro. Os pares
+    (configuração, fold) já avaliados são lidos do cache, então repetir a
+    busca só treina o que mudou. O score é o MAE negativo (maior é melhor).
+    """
+    param_grid = param_grid or PARAM_GRIDS[estimator_name]
+    candidates = list(ParameterGrid(param_grid))
+    X = np.asarray(X, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    n_samples = len(y)
+
+    # A última rodada sempre usa o dataset inteiro
+    n_rounds = max(1, math.ceil(math.log(len(candidates), factor)))
+    min_resources = min_resources or n_splits * 20
+
+    # Uma única permutação: cada rodada usa um prefixo maior da mesma amostra
+    order = np.random.RandomState(random_state).permutation(n_samples)
+    fingerprint = dataset_fingerprint(X, y)
+    cache = ScoreCache(cache_path)
+    history = []
+
+    try:
+        for round_idx in range(n_rounds):
+            n_resources = max(
+                n_samples // factor ** (n_rounds - 1 - round_idx), min_resources
+            )
+            n_resources = min(n_resources, n_samples)
+            sample = order[:n_resources]
+            folds = list(
+                KFold(n_splits, shuffle=True, random_state=random_state).split(sample)
+            )
+            tasks = {}
+            for c, params in enumerate(candidates):
+                for fold in range(n_splits):
+                    key = _task_key(
+                        fingerprint,
+                        estimator_name,
+                        params,
+                        n_resources,
+                        fold,
+                        n_splits,
+                        random_state,
+                    )
+                    tasks[key] = (c, fold)
+
+            cached = cache.get_many(tasks)
+            pending = [key for key in tasks if key not in cached]
+            start = time.perf_counter()
+            results = Parallel(n_jobs=n_jobs)(
+                delayed(_fit_and_score)(
+                    estimator_name,
+                    candidates[tasks[key][0]],
+                    X,
+                    y,
+                    sample[folds[tasks[key][1]][0]],
+                    sample[folds[tasks[key][1]][1]],
+                )
+                for key in pending
+            )
+            cache.put_many(
+                (
+                    key,
+                    estimator_name,
+                    json.dumps(candidates[tasks[key][0]], sort_keys=True, default=str),
+                    n_resources,
+                    tasks[key][1],
+                    score,
+                    fit_seconds,
+                )
+                for key, (score, fit_seconds) in zip(pending, results)
+            )
+            scores = dict(cached)
+            scores.update((key, score) for key, (score, _) in zip(pending, results))
+
+            mean_scores = np.zeros(len(candidates))
+            for key, (c, _) in tasks.items():
+                mean_scores[c] += scores[key] / n_splits
+
+            history.append(
+                {
+                    "n_resources": n_resources,
+                    "n_candidates": len(candidates),
+                    "fits": len(pending),
+                    "cached": len(cached),
+                    "seconds": time.perf_counter() - start,
+                    "scores": [
+                        (params, float(score))
+                        for params, score in zip(candidates, mean_scores)
+                    ],
+                }
+            )
+            if verbose:
+                print(
+                    f"Rodada {len(history)}: {len(candidates)} candidatos, "
+                    f"{n_resources} linhas, {len(pending)} treinos "
+                    f"({len(cached)} do cache), {history[-1]['seconds']:.1f}s"
+                )
+
+            if round_idx == n_rounds - 1:
+                break
+
+            keep = max(1, math.ceil(len(candidates) / factor))
+            best = np.argsort(-mean_scores, kind="stable")[:keep]
+            candidates = [candidates[i] for i in best]
+    finally:
+        cache.close()
+
+    best = int(np.argmax(mean_scores))
+    return {
+        "best_params": candidates[best],
+        "best_score": float(mean_scores[best]),
+        "history": history,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Busca de hiperparâmetros")
+    parser.add_argument("--estimator", default="tree", choices=sorted(PARAM_GRIDS))
+    parser.add_argument("--csv", default="app/dataset/fipe_cars.csv")
+    parser.add_argument("--cv", type=int, default=5)
+    parser.add_argument("--factor", type=int, default=3)
+    parser.add_argument("--n-jobs", type=int, default=-1)
+    parser.add_argument("--cache", default=TUNING_CACHE_PATH)
+    args = parser.parse_args()
+
+    car_model = CarPriceModel()
+    if not car_model.load_and_preprocess_data(args.csv):
+        return
+    X, y = car_model.build_features()
+
+    start = time.perf_counter()
+    result = successive_halving(
+        args.estimator,
+        X,
+        y,
+        n_splits=args.cv,
+        factor=args.factor,
+        n_jobs=args.n_jobs,
+        cache_path=args.cache,
+    )
+    print(f"Melhores parâmetros: {result['best_params']}")
+    print(f"Melhor MAE: R$ {-result['best_score']:,.2f}")
+    print(f"Tempo total: {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()